@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from winey.bench import create_schema
+from winey.db import close_orm, init_orm
+
+
+@pytest.fixture
+def database_uri(tmp_path):
+    """
+    URI of an SQLite database with all tables created
+    """
+    database_uri = f'sqlite+aiosqlite:///{tmp_path}/winey.db'
+    asyncio.run(create_schema(database_uri))
+    return database_uri
+
+
+@pytest.fixture
+def run_with_orm(database_uri):
+    """
+    Runs a coroutine function in a new event loop with OrmSession bound to the test database
+    and returns its result
+    """
+    def run(test, *args):
+        async def main():
+            init_orm(database_uri)
+            try:
+                return await test(*args)
+            finally:
+                await close_orm()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,33 @@
+from winey.cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_counts_hits_and_misses():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('winey.cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(2, ttl=10)
+    cache.put('a', 1)
+    now[0] += 9
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 0
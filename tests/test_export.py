@@ -0,0 +1,86 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from winey.db.models import TastingRecord, WinePhoto
+from winey.export import export_chunks
+
+
+BASE_URL = 'https://photos.example.com'
+
+
+def tasting_records(count=2):
+    return [
+        TastingRecord(
+            id=number,
+            dt=datetime(2021, 8, number, 20, 0, tzinfo=timezone.utc),
+            wine_name=f'Кьянти №{number}',
+            region='Тоскана',
+            grapes='Санджовезе, Мерло',
+            vintage_year=2018 if number % 2 else None,
+            experience='Вишня,\n"табак"',
+            photos=[
+                WinePhoto(id=f'photo-{number}', is_uploaded=True, object_key=f'hash-{number}'),
+                WinePhoto(id=f'pending-{number}', is_uploaded=False),
+            ],
+        )
+        for number in range(1, count + 1)
+    ]
+
+
+async def aiter(items):
+    for item in items:
+        yield item
+
+
+def export(records, export_format, chunk_size=64 * 1024):
+    async def main():
+        return [chunk async for chunk in export_chunks(aiter(records), export_format, BASE_URL, chunk_size)]
+
+    return asyncio.run(main())
+
+
+def test_csv_export():
+    chunks = export(tasting_records(), 'csv')
+    content = b''.join(chunks).decode()
+    assert content.startswith('\ufeff')
+    rows = list(csv.DictReader(io.StringIO(content[1:])))
+    assert [row['wine_name'] for row in rows] == ['Кьянти №1', 'Кьянти №2']
+    assert rows[0]['experience'] == 'Вишня,\n"табак"'
+    assert rows[0]['dt'] == '2021-08-01T20:00:00+00:00'
+    assert (rows[0]['vintage_year'], rows[1]['vintage_year']) == ('2018', '')
+    # photos which aren't uploaded yet are left out
+    assert rows[0]['photos'] == f'{BASE_URL}/hash-1'
+
+
+def test_jsonl_export():
+    chunks = export(tasting_records(), 'jsonl')
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert rows[0] == {
+        'id': 1,
+        'dt': '2021-08-01T20:00:00+00:00',
+        'wine_name': 'Кьянти №1',
+        'region': 'Тоскана',
+        'grapes': 'Санджовезе, Мерло',
+        'vintage_year': 2018,
+        'experience': 'Вишня,\n"табак"',
+        'photos': [f'{BASE_URL}/hash-1'],
+    }
+    assert rows[1]['vintage_year'] is None
+
+
+def test_export_is_chunked():
+    records = tasting_records(20)
+    chunks = export(records, 'jsonl', chunk_size=500)
+    assert len(chunks) > 1
+    # chunks end with whole records
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert len(b''.join(chunks).splitlines()) == 20
+    assert b''.join(chunks) == b''.join(export(records, 'jsonl'))
+
+
+def test_empty_export():
+    assert export([], 'jsonl') == []
+    content = b''.join(export([], 'csv')).decode()
+    assert content == '\ufeffid,dt,wine_name,region,grapes,vintage_year,experience,photos\r\n'
@@ -0,0 +1,286 @@
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+import pytest
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from sqlalchemy.future import select
+from winey.bot import prefetch
+from winey.bot.handlers import MAX_PHOTOS, conversation_photos, register_handlers
+from winey.bot.prefetch import PhotoPrefetcher
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob, PhotoUpload, TastingRecord, WinePhoto
+from winey.db.queries import fetch_tasting_records_page
+from .fakes import FakeS3Client, store_telegram_photo
+
+
+CHAT = USER = 1
+DT = datetime(2021, 8, 1, 20, 0, tzinfo=timezone.utc)
+ANSWERS = ['Кьянти', 'Тоскана', 'Санджовезе', '2018']
+
+
+class FakePhotoUploadWorkerPool:
+
+    def __init__(self):
+        self.wake_ups = 0
+
+    def wake_up(self):
+        self.wake_ups += 1
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    replies = []
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Bot, 'send_message', send_message)
+    return replies
+
+
+@pytest.fixture
+def run_with_dispatcher(monkeypatch, run_with_orm, replies):
+    """
+    Runs a coroutine function with the dispatcher which has the bot's handlers registered,
+    photos are "stored" by tests.fakes.store_telegram_photo
+    """
+    monkeypatch.setattr(prefetch, 'store_telegram_photo', store_telegram_photo)
+
+    async def run(test):
+        dp = Dispatcher(Bot('123456:token'), storage=MemoryStorage())
+        Dispatcher.set_current(dp)
+        Bot.set_current(dp.bot)
+        dp['photo_prefetch'] = PhotoPrefetcher(dp.bot, FakeS3Client(), None)
+        dp['photo_uploads'] = FakePhotoUploadWorkerPool()
+        register_handlers(dp)
+        try:
+            await test(dp)
+        finally:
+            await dp['photo_prefetch'].stop()
+            await dp.storage.close()
+
+    return lambda test: run_with_orm(run, test)
+
+
+_update_ids = itertools.count(1)
+
+
+async def send(dp: Dispatcher, text=None, photo=None, media_group_id=None):
+    """
+    Handles a message of the user, `photo` is the file id of the photo sent
+    """
+    update_id = next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(DT.timestamp()) + update_id,
+        'chat': {'id': CHAT, 'type': 'private'},
+        'from': {'id': USER, 'is_bot': False, 'first_name': 'Anna'},
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if photo is not None:
+        message['photo'] = [
+            {'file_id': f'{photo}-small', 'file_unique_id': f'unique-{photo}-small', 'width': 320, 'height': 240},
+            {'file_id': photo, 'file_unique_id': f'unique-{photo}', 'width': 1280, 'height': 960},
+        ]
+    if media_group_id is not None:
+        message['media_group_id'] = media_group_id
+    # every update is handled in a task of its own like it's done by polling, aiogram keeps its state in the context
+    await asyncio.create_task(dp.process_update(types.Update(update_id=update_id, message=message)))
+
+
+async def answer_questions(dp: Dispatcher):
+    for text in ANSWERS + ['Вишня']:
+        await send(dp, text)
+
+
+async def fetch_records():
+    async with OrmSession() as session:
+        return (await session.execute(select(TastingRecord))).scalars().all()
+
+
+async def fetch_photos():
+    async with OrmSession() as session:
+        return (await session.execute(select(WinePhoto).order_by(WinePhoto.position))).scalars().all()
+
+
+async def fetch_uploads():
+    async with OrmSession() as session:
+        return (await session.execute(select(PhotoUpload))).scalars().all()
+
+
+def test_prefetched_photo_is_saved_uploaded(run_with_dispatcher, replies):
+    async def test(dp):
+        await send(dp, '/newrecord')
+        await send(dp, photo='label')
+        await answer_questions(dp)
+
+        [record] = await fetch_records()
+        assert (record.wine_name, record.region, record.grapes, record.vintage_year, record.experience) == \
+            ('Кьянти', 'Тоскана', 'Санджовезе', 2018, 'Вишня')
+        [photo] = await fetch_photos()
+        assert (photo.is_uploaded, photo.object_key) == (True, 'hash-label')
+        assert await fetch_uploads() == []
+        assert dp['photo_uploads'].wake_ups == 0
+        assert replies[-1].startswith('Готово')
+
+    run_with_dispatcher(test)
+
+
+def test_slow_prefetch_delays_the_upload(monkeypatch, run_with_dispatcher):
+    stored = asyncio.Event()
+
+    async def store_slowly(*args):
+        await stored.wait()
+        return await store_telegram_photo(*args)
+
+    async def test(dp):
+        monkeypatch.setattr(prefetch, 'store_telegram_photo', store_slowly)
+        dp['photo_prefetch'].wait_timeout = 0.01
+        await send(dp, '/newrecord')
+        await send(dp, photo='label')
+        await answer_questions(dp)
+        saved = datetime.now(timezone.utc)
+
+        [photo] = await fetch_photos()
+        assert not photo.is_uploaded
+        [upload] = await fetch_uploads()
+        # the outbox doesn't transfer the file while it's still being prefetched
+        next_attempt_dt = upload.next_attempt_dt.replace(tzinfo=timezone.utc)
+        assert saved + timedelta(seconds=50) < next_attempt_dt < saved + timedelta(seconds=61)
+        assert dp['photo_uploads'].wake_ups == 0
+        stored.set()
+
+    run_with_dispatcher(test)
+
+
+def test_photo_which_is_not_prefetched_is_uploaded_right_away(monkeypatch, run_with_dispatcher):
+    async def test(dp):
+        dp['photo_prefetch'].max_tasks = 0
+        await send(dp, '/newrecord')
+        await send(dp, photo='label')
+        await answer_questions(dp)
+
+        [upload] = await fetch_uploads()
+        assert upload.next_attempt_dt.replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc)
+        assert dp['photo_uploads'].wake_ups == 1
+
+    run_with_dispatcher(test)
+
+
+def test_stored_photo_is_reused(run_with_dispatcher):
+    async def test(dp):
+        async with OrmSession() as session:
+            session.add(PhotoBlob(
+                telegram_file_unique_id='unique-label', content_hash='stored', object_key='stored',
+                variants={'original': 1280}, created_dt=datetime.now(timezone.utc),
+            ))
+            await session.commit()
+        # the photo isn't prefetched, the stored file is found by its unique id anyway
+        dp['photo_prefetch'].max_tasks = 0
+        await send(dp, '/newrecord')
+        await send(dp, photo='label')
+        await answer_questions(dp)
+
+        [photo] = await fetch_photos()
+        assert (photo.is_uploaded, photo.object_key, photo.variants) == (True, 'stored', {'original': 1280})
+        assert await fetch_uploads() == []
+        assert dp['photo_uploads'].wake_ups == 0
+
+    run_with_dispatcher(test)
+
+
+def test_album_photos_are_saved_in_order(run_with_dispatcher):
+    async def test(dp):
+        await send(dp, '/newrecord')
+        await send(dp, photo='label', media_group_id='album')
+        # the rest of the album comes after the conversation has moved on, even past the next question
+        await send(dp, photo='back', media_group_id='album')
+        await send(dp, ANSWERS[0])
+        await send(dp, photo='cork', media_group_id='album')
+        # neither duplicates nor photos of other albums are added
+        await send(dp, photo='back', media_group_id='album')
+        await send(dp, photo='glass', media_group_id='other')
+        for text in ANSWERS[1:] + ['Вишня']:
+            await send(dp, text)
+
+        photos = await fetch_photos()
+        assert [(photo.position, photo.object_key, photo.is_uploaded) for photo in photos] == [
+            (0, 'hash-label', True), (1, 'hash-back', True), (2, 'hash-cork', True),
+        ]
+        async with OrmSession() as session:
+            [record], _ = await fetch_tasting_records_page(session, 10)
+        assert [photo.object_key for photo in record.photos] == ['hash-label', 'hash-back', 'hash-cork']
+
+    run_with_dispatcher(test)
+
+
+def test_album_photos_are_limited(run_with_dispatcher):
+    async def test(dp):
+        await send(dp, '/newrecord')
+        for index in range(MAX_PHOTOS + 2):
+            await send(dp, photo=f'photo-{index}', media_group_id='album')
+        await answer_questions(dp)
+
+        photos = await fetch_photos()
+        assert [photo.object_key for photo in photos] == [f'hash-photo-{index}' for index in range(MAX_PHOTOS)]
+
+    run_with_dispatcher(test)
+
+
+def test_photo_outside_of_conversation_is_ignored(run_with_dispatcher, replies):
+    async def test(dp):
+        await send(dp, photo='label', media_group_id='album')
+        assert replies == []
+        assert dp['photo_prefetch']._tasks == {}
+
+    run_with_dispatcher(test)
+
+
+def test_cancel_discards_album(run_with_dispatcher, replies):
+    async def test(dp):
+        prefetcher = dp['photo_prefetch']
+        prefetcher.ttl = 60
+        await send(dp, '/newrecord')
+        await send(dp, photo='label', media_group_id='album')
+        await send(dp, photo='back', media_group_id='album')
+        await send(dp, '/cancel')
+        assert replies[-1] == 'Ладно, не в этот раз'
+        assert await dp.current_state(chat=CHAT, user=USER).get_state() is None
+        assert prefetcher._tasks == {}
+
+        # the next conversation has only its own photo
+        await send(dp, '/newrecord')
+        await send(dp, photo='cork')
+        await answer_questions(dp)
+        assert [photo.object_key for photo in await fetch_photos()] == ['hash-cork']
+
+        # photos of the cancelled album are cleaned up once nothing refers to them
+        await asyncio.gather(*prefetcher._background)
+        await prefetcher.sweep()
+        assert sorted(prefetcher.s3client.deleted) == [
+            'hash-back', 'hash-label', 'thumb/hash-back', 'thumb/hash-label',
+        ]
+
+    run_with_dispatcher(test)
+
+
+@pytest.mark.parametrize('data, expected', [
+    (
+        {'photos': [{'id': 'a', 'file_id': 'file-a', 'file_unique_id': 'unique-a'}]},
+        [{'id': 'a', 'file_id': 'file-a', 'file_unique_id': 'unique-a'}],
+    ),
+    (
+        {'photo_id': 'a', 'photo_file_id': 'file-a', 'photo_file_unique_id': 'unique-a'},
+        [{'id': 'a', 'file_id': 'file-a', 'file_unique_id': 'unique-a'}],
+    ),
+    (
+        {'s3_obj_key': 'a', 'photo_file_id': 'file-a'},
+        [{'id': 'a', 'file_id': 'file-a', 'file_unique_id': None}],
+    ),
+])
+def test_conversation_photos(data, expected):
+    assert conversation_photos(data) == expected
@@ -0,0 +1,46 @@
+import pytest
+from winey.metrics import REGISTRY, Counter, Histogram
+
+
+@pytest.fixture
+def register():
+    names = []
+
+    def register(metric_class, name, *args, **kwargs):
+        names.append(name)
+        return metric_class(name, *args, **kwargs)
+
+    yield register
+    for name in names:
+        REGISTRY.unregister(name)
+
+
+def exposed(name):
+    return [line for line in REGISTRY.expose().splitlines() if name in line]
+
+
+def test_histogram_exposition(register):
+    histogram = register(Histogram, 'test_duration_seconds', 'Time spent', ['handler'], buckets=(1, 0.1))
+    histogram.observe(0.05, handler='/wine-log')
+    histogram.observe(0.5, handler='/wine-log')
+    histogram.observe(5, handler='/wine-log')
+    assert exposed('test_duration_seconds') == [
+        '# HELP test_duration_seconds Time spent',
+        '# TYPE test_duration_seconds histogram',
+        'test_duration_seconds_bucket{handler="/wine-log",le="0.1"} 1',
+        'test_duration_seconds_bucket{handler="/wine-log",le="1"} 2',
+        'test_duration_seconds_bucket{handler="/wine-log",le="+Inf"} 3',
+        'test_duration_seconds_sum{handler="/wine-log"} 5.55',
+        'test_duration_seconds_count{handler="/wine-log"} 3',
+    ]
+
+
+def test_label_values_are_escaped(register):
+    counter = register(Counter, 'test_total', 'Lines\nwith \\ in help', ['value'])
+    counter.inc(value='"quoted"\\path\nnext line')
+    counter.inc(value='"quoted"\\path\nnext line')
+    assert exposed('test_total') == [
+        '# HELP test_total Lines\\nwith \\\\ in help',
+        '# TYPE test_total counter',
+        'test_total{value="\\"quoted\\"\\\\path\\nnext line"} 2',
+    ]
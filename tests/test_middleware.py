@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from winey.bot.middleware import GetOrCreateUserMiddleware, ThrottlingMiddleware
+
+
+def test_get_or_create_user(run_with_orm):
+    async def main():
+        from_user = types.User(id=1, username='taster', first_name='Anna', language_code='ru')
+        joined_dt = datetime(2021, 8, 1, 12, 0)
+        user, is_new_user = await GetOrCreateUserMiddleware.get_or_create_user(from_user, joined_dt)
+        assert is_new_user
+        assert (user.id, user.username, user.joined_dt) == (1, 'taster', joined_dt)
+
+        # the first update delivered again
+        user, is_new_user = await GetOrCreateUserMiddleware.get_or_create_user(from_user, joined_dt)
+        assert not is_new_user
+
+        from_user = types.User(id=1, username='sommelier', first_name='Anna', language_code='ru')
+        user, is_new_user = await GetOrCreateUserMiddleware.get_or_create_user(from_user, datetime(2021, 8, 2))
+        assert not is_new_user
+        assert (user.id, user.username, user.joined_dt) == (1, 'taster', joined_dt)
+
+    run_with_orm(main)
+
+
+def test_global_throttling_doesnt_count_against_user(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('winey.throttling.time.monotonic', lambda: now[0])
+    replies = []
+
+    async def reply(self, text, *args, **kwargs):
+        replies.append((self.from_user.id, text))
+
+    monkeypatch.setattr(types.Message, 'reply', reply)
+    middleware = ThrottlingMiddleware(user_rate=0.1, user_burst=1, global_rate=1, global_burst=1)
+
+    def handle(user_id):
+        message = types.Message(message_id=1, chat={'id': user_id, 'type': 'private'}, **{'from': {'id': user_id}})
+        try:
+            asyncio.run(middleware.on_pre_process_message(message, {}))
+        except CancelHandler:
+            return False
+        return True
+
+    assert handle(1)
+    # everyone together is sending too fast
+    assert not handle(2)
+    assert [user_id for user_id, _ in replies] == [2]
+    now[0] += 1
+    # the second user's dropped message hasn't spent their own limit
+    assert handle(2)
+    assert not handle(2)
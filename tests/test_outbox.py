@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.future import select
+from winey.bot.outbox import PhotoUploadWorkerPool
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob, PhotoUpload, WinePhoto
+
+
+def aware(dt):
+    # SQLite gives naive datetimes back
+    return dt.replace(tzinfo=dt.tzinfo or timezone.utc)
+
+
+async def add_uploads(*next_attempt_dts):
+    async with OrmSession() as session:
+        for number, next_attempt_dt in enumerate(next_attempt_dts):
+            photo_id = f'photo-{number}'
+            session.add(WinePhoto(id=photo_id, is_uploaded=False))
+            session.add(PhotoUpload(
+                photo_id=photo_id,
+                telegram_file_id=f'file-{number}',
+                telegram_file_unique_id=f'unique-{number}',
+                next_attempt_dt=next_attempt_dt,
+                created_dt=datetime.now(timezone.utc),
+            ))
+        await session.commit()
+
+
+async def get_upload(upload_id):
+    async with OrmSession() as session:
+        return await session.get(PhotoUpload, upload_id)
+
+
+def test_due_uploads_are_leased(run_with_orm):
+    async def test():
+        now = datetime.now(timezone.utc)
+        await add_uploads(now - timedelta(minutes=1), now - timedelta(minutes=2), now + timedelta(minutes=1))
+        pool = PhotoUploadWorkerPool(None, None, None, lease_timeout=300)
+
+        uploads = await pool._claim_batch()
+        # oldest first, the one not due yet is left alone
+        assert [upload.photo_id for upload in uploads] == ['photo-1', 'photo-0']
+        for upload in uploads:
+            upload = await get_upload(upload.id)
+            assert upload.attempts == 1
+            assert aware(upload.next_attempt_dt) > now + timedelta(seconds=290)
+        # leased uploads aren't claimed again until the lease expires
+        assert await pool._claim_batch() == []
+
+    run_with_orm(test)
+
+
+def test_claimed_batch_is_limited(run_with_orm):
+    async def test():
+        now = datetime.now(timezone.utc)
+        await add_uploads(*[now - timedelta(minutes=1)] * 3)
+        pool = PhotoUploadWorkerPool(None, None, None, batch_size=2)
+        assert len(await pool._claim_batch()) == 2
+        assert len(await pool._claim_batch()) == 1
+
+    run_with_orm(test)
+
+
+def test_failed_uploads_are_retried_with_backoff(run_with_orm):
+    async def test():
+        await add_uploads(datetime.now(timezone.utc))
+        pool = PhotoUploadWorkerPool(None, None, None, max_attempts=3, retry_delay=5)
+
+        for attempt, delay in ((1, 5), (2, 10)):
+            upload = (await pool._claim_batch())[0]
+            assert upload.attempts == attempt
+            before = datetime.now(timezone.utc)
+            await pool._fail(upload, ValueError('timeout'))
+            upload = await get_upload(upload.id)
+            assert upload.status == PhotoUpload.PENDING
+            assert upload.last_error == "ValueError('timeout')"
+            next_attempt_dt = aware(upload.next_attempt_dt)
+            assert before + timedelta(seconds=delay) <= next_attempt_dt <= before + timedelta(seconds=delay + 1)
+            # pretend the backoff is over
+            async with OrmSession() as session:
+                (await session.get(PhotoUpload, upload.id)).next_attempt_dt = before
+                await session.commit()
+
+        upload = (await pool._claim_batch())[0]
+        await pool._fail(upload, ValueError('timeout'))
+        assert (await get_upload(upload.id)).status == PhotoUpload.FAILED
+        assert await pool._claim_batch() == []
+
+    run_with_orm(test)
+
+
+def test_completed_upload_marks_photo_uploaded(run_with_orm):
+    async def test():
+        await add_uploads(datetime.now(timezone.utc))
+        pool = PhotoUploadWorkerPool(None, None, None)
+        upload = (await pool._claim_batch())[0]
+        blob = PhotoBlob(
+            telegram_file_unique_id='unique-0', content_hash='hash', object_key='hash',
+            variants={'original': 1280}, created_dt=datetime.now(timezone.utc),
+        )
+        await pool._complete(upload, blob)
+
+        assert (await get_upload(upload.id)).status == PhotoUpload.DONE
+        async with OrmSession() as session:
+            photo = await session.get(WinePhoto, 'photo-0')
+            assert (photo.is_uploaded, photo.object_key, photo.variants) == (True, 'hash', {'original': 1280})
+            assert (await session.execute(select(PhotoBlob.object_key))).scalars().all() == ['hash']
+
+    run_with_orm(test)
@@ -0,0 +1,115 @@
+import hashlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import func
+from sqlalchemy.future import select
+from winey.bot import photos
+from winey.bot.photos import save_photo_blob, store_telegram_photo
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob
+from .fakes import FakeS3Client
+
+
+LABEL = b'\xff\xd8label\xff\xd9'
+LABEL_HASH = hashlib.sha256(LABEL).hexdigest()
+
+
+class FakeBot:
+    """
+    Serves files of `contents` by file id, the file unique id is the file id prefixed with "unique-"
+    """
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.downloads = []
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=file_id, file_unique_id=f'unique-{file_id}')
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    bot = FakeBot({'label': LABEL, 'label-again': LABEL, 'back': b'\xff\xd8back\xff\xd9'})
+
+    async def iter_telegram_file(bot, file_path):
+        bot.downloads.append(file_path)
+        data = bot.contents[file_path]
+        # in several chunks, as they are hashed one by one
+        for start in range(0, len(data), 4):
+            yield data[start:start + 4]
+
+    async def upload_variants(s3client, process_pool, key, data):
+        await s3client.upload_bytes(f'thumb/{key}', data[:4])
+        return {'original': 1280, 'thumb': 320}
+
+    monkeypatch.setattr(photos, 'iter_telegram_file', iter_telegram_file)
+    monkeypatch.setattr(photos, 'upload_variants', upload_variants)
+    return bot
+
+
+async def store_and_save(bot, s3client, file_id):
+    blob = await store_telegram_photo(bot, s3client, None, file_id, f'unique-{file_id}')
+    async with OrmSession() as session:
+        await save_photo_blob(session, blob)
+        await session.commit()
+    return blob
+
+
+def test_photo_is_stored_under_its_content_hash(run_with_orm, bot):
+    async def main():
+        s3client = FakeS3Client()
+        blob = await store_and_save(bot, s3client, 'label')
+        assert (blob.telegram_file_unique_id, blob.content_hash, blob.object_key) == \
+            ('unique-label', LABEL_HASH, LABEL_HASH)
+        assert blob.variants == {'original': 1280, 'thumb': 320}
+        assert s3client.uploads == [LABEL_HASH, f'thumb/{LABEL_HASH}']
+        assert s3client.objects[LABEL_HASH] == LABEL
+
+    run_with_orm(main)
+
+
+def test_same_content_is_uploaded_once(run_with_orm, bot):
+    async def main():
+        s3client = FakeS3Client()
+        first = await store_and_save(bot, s3client, 'label')
+        # the same photo forwarded or sent again as another file
+        second = await store_and_save(bot, s3client, 'label-again')
+        assert bot.downloads == ['label', 'label-again']
+        assert s3client.uploads == [LABEL_HASH, f'thumb/{LABEL_HASH}']
+        assert second.telegram_file_unique_id == 'unique-label-again'
+        assert (second.object_key, second.variants) == (first.object_key, first.variants)
+
+        await store_and_save(bot, s3client, 'back')
+        assert len(s3client.uploads) == 4
+
+    run_with_orm(main)
+
+
+def test_known_file_is_not_downloaded(run_with_orm, bot):
+    async def main():
+        s3client = FakeS3Client()
+        await store_and_save(bot, s3client, 'label')
+        blob = await store_telegram_photo(bot, s3client, None, 'label', 'unique-label')
+        assert blob.object_key == LABEL_HASH
+        assert bot.downloads == ['label']
+        assert len(s3client.uploads) == 2
+
+    run_with_orm(main)
+
+
+def test_blob_is_saved_once(run_with_orm):
+    async def main():
+        async with OrmSession() as session:
+            saved = []
+            # e.g. a prefetch and the upload outbox storing the same file
+            for _ in range(2):
+                saved.append(await save_photo_blob(session, PhotoBlob(
+                    telegram_file_unique_id='unique-label', content_hash=LABEL_HASH, object_key=LABEL_HASH,
+                    variants={'original': 1280}, created_dt=datetime.now(timezone.utc),
+                )))
+            await session.commit()
+            count = (await session.execute(select(func.count()).select_from(PhotoBlob))).scalar_one()
+        return saved, count
+
+    assert run_with_orm(main) == ([True, False], 1)
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy.future import select
+from winey.bot import prefetch
+from winey.bot.prefetch import PhotoPrefetcher
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob, WinePhoto
+from .fakes import FakeS3Client, store_telegram_photo
+
+
+@pytest.fixture
+def run_with_prefetcher(monkeypatch, run_with_orm):
+    monkeypatch.setattr(prefetch, 'store_telegram_photo', store_telegram_photo)
+
+    async def run(test):
+        prefetcher = PhotoPrefetcher(None, FakeS3Client(), None, ttl=60)
+        try:
+            await test(prefetcher)
+        finally:
+            await prefetcher.stop()
+
+    return lambda test: run_with_orm(run, test)
+
+
+async def prefetched(prefetcher, key):
+    await asyncio.gather(*(task for task, _ in prefetcher._tasks[key].values()))
+
+
+async def stored_file_unique_ids():
+    async with OrmSession() as session:
+        return set((await session.execute(select(PhotoBlob.telegram_file_unique_id))).scalars())
+
+
+def test_claim_returns_stored_photos_and_keeps_others_running(run_with_prefetcher):
+    async def test(prefetcher):
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        prefetcher.start('conversation', 'file-2', 'unique-2')
+        blobs, deadlines = await prefetcher.claim('conversation', ['unique-1', 'unique-3'])
+        assert list(blobs) == ['unique-1']
+        assert deadlines == {}
+        assert blobs['unique-1'].object_key == 'hash-file-1'
+        # the unclaimed prefetch isn't cancelled, it's kept until it's done
+        await asyncio.gather(*prefetcher._background)
+        assert await stored_file_unique_ids() == {'unique-1', 'unique-2'}
+        assert await prefetcher.claim('conversation', ['unique-1']) == ({}, {})
+
+    run_with_prefetcher(test)
+
+
+def test_slow_prefetch_is_claimed_with_its_deadline(monkeypatch, run_with_prefetcher):
+    stored = asyncio.Event()
+
+    async def store_slowly(*args):
+        await stored.wait()
+        return await store_telegram_photo(*args)
+
+    async def test(prefetcher):
+        monkeypatch.setattr(prefetch, 'store_telegram_photo', store_slowly)
+        prefetcher.wait_timeout = 0.01
+        started = datetime.now(timezone.utc)
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        blobs, deadlines = await prefetcher.claim('conversation', ['unique-1'])
+        assert blobs == {}
+        assert started + timedelta(seconds=59) < deadlines['unique-1'] <= started + timedelta(seconds=61)
+        # the prefetch goes on and stores the file for the outbox to find
+        stored.set()
+        await asyncio.gather(*prefetcher._background)
+        assert await stored_file_unique_ids() == {'unique-1'}
+
+    run_with_prefetcher(test)
+
+
+def test_prefetch_times_out(monkeypatch, run_with_prefetcher):
+    async def store_forever(*args):
+        await asyncio.Event().wait()
+
+    async def test(prefetcher):
+        monkeypatch.setattr(prefetch, 'store_telegram_photo', store_forever)
+        prefetcher.timeout = 0.01
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        await prefetched(prefetcher, 'conversation')
+        assert await prefetcher.claim('conversation', ['unique-1']) == ({}, {})
+
+    run_with_prefetcher(test)
+
+
+def test_resending_a_discarded_photo_keeps_it(run_with_prefetcher):
+    async def test(prefetcher):
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        await prefetched(prefetcher, 'conversation')
+        # /cancel, then the same photo is sent again
+        prefetcher.discard('conversation')
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        await prefetched(prefetcher, 'conversation')
+        await prefetcher.sweep()
+        assert prefetcher.s3client.deleted == []
+
+        blobs, _ = await prefetcher.claim('conversation', ['unique-1'])
+        async with OrmSession() as session:
+            session.add(WinePhoto(id='photo-1', object_key=blobs['unique-1'].object_key))
+            await session.commit()
+        await prefetcher.sweep()
+        assert prefetcher.s3client.deleted == []
+        assert await stored_file_unique_ids() == {'unique-1'}
+
+    run_with_prefetcher(test)
+
+
+def test_sweep_deletes_abandoned_photos(run_with_prefetcher):
+    async def test(prefetcher):
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        prefetcher.discard('conversation')
+        await asyncio.gather(*prefetcher._background)
+        assert await stored_file_unique_ids() == {'unique-1'}
+        await prefetcher.sweep()
+        assert sorted(prefetcher.s3client.deleted) == ['hash-file-1', 'thumb/hash-file-1']
+        assert await stored_file_unique_ids() == set()
+
+    run_with_prefetcher(test)
+
+
+def test_sweep_keeps_recent_photos(run_with_prefetcher):
+    async def test(prefetcher):
+        prefetcher.ttl = 3 * 3600
+        prefetcher.start('conversation', 'file-1', 'unique-1')
+        prefetcher.discard('conversation')
+        await asyncio.gather(*prefetcher._background)
+        await prefetcher.sweep()
+        assert prefetcher.s3client.deleted == []
+        assert await stored_file_unique_ids() == {'unique-1'}
+
+    run_with_prefetcher(test)
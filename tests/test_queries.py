@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+import pytest
+from winey.db import OrmSession
+from winey.db.models import TastingRecord
+from winey.db.queries import decode_cursor, encode_cursor, fetch_tasting_records_page
+
+
+def test_cursor_round_trip():
+    dt = datetime(2021, 8, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(TastingRecord(id=42, dt=dt))
+    assert decode_cursor(cursor) == (dt, 42)
+
+
+@pytest.mark.parametrize('cursor', ['', '42', 'x:2021-08-01T12:30:15', '42:yesterday'])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('query', ['Кьянти', 'кьянти', 'КЬЯНТИ', 'тоскана', 'CLASSICO'])
+def test_search_is_case_insensitive(run_with_orm, query):
+    async def main():
+        async with OrmSession() as session:
+            session.add_all([
+                TastingRecord(
+                    user_id=1, dt=datetime(2021, 8, 1, tzinfo=timezone.utc), wine_name='Кьянти Classico',
+                    region='Тоскана', grapes='Санджовезе', experience='Вишня',
+                ),
+                TastingRecord(
+                    user_id=1, dt=datetime(2021, 8, 2, tzinfo=timezone.utc), wine_name='Риоха',
+                    region='Испания', grapes='Темпранильо', experience='Ваниль',
+                ),
+            ])
+            await session.commit()
+            tasting_records, _ = await fetch_tasting_records_page(session, 10, query=query)
+        return [tasting_record.wine_name for tasting_record in tasting_records]
+
+    assert run_with_orm(main) == ['Кьянти Classico']
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import asyncio
+import gzip
+from types import SimpleNamespace
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from winey.cache import LRUCache
+from winey.webapp import responses
+from winey.webapp.handlers import cached_response
+from winey.webapp.responses import (
+    StreamCompressor, accepted_encoding, encode_body, entity_tag, is_not_modified, MIN_COMPRESSED_SIZE,
+)
+
+
+UPDATED_DT = datetime(2021, 8, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+
+def request(**headers):
+    return make_mocked_request('GET', '/', headers=headers)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('', None),
+    ('gzip, deflate', 'gzip'),
+    ('gzip;q=0', None),
+    ('identity', None),
+    ('*', responses.ENCODINGS[0]),
+    ('br;q=0, *;q=0.5', 'gzip'),
+])
+def test_accepted_encoding(header, expected):
+    assert accepted_encoding(request(**{'Accept-Encoding': header})) == expected
+
+
+def test_prefers_brotli_when_available():
+    if 'br' not in responses.ENCODINGS:
+        pytest.skip('brotli is not installed')
+    assert accepted_encoding(request(**{'Accept-Encoding': 'gzip, br'})) == 'br'
+
+
+def test_small_bodies_are_not_compressed():
+    assert encode_body(b'x', 'gzip') == (None, b'x')
+    body = b'x' * MIN_COMPRESSED_SIZE
+    encoding, compressed = encode_body(body, 'gzip')
+    assert encoding == 'gzip'
+    assert gzip.decompress(compressed) == body
+
+
+def test_stream_compressor_output_is_one_gzip_stream():
+    compressor = StreamCompressor('gzip')
+    body = compressor.compress(b'hello ') + compressor.compress(b'world') + compressor.finish()
+    assert gzip.decompress(body) == b'hello world'
+
+
+@pytest.mark.parametrize('header, expected', [
+    (entity_tag(3), True),
+    (entity_tag(3, 'gzip'), True),
+    (f'W/{entity_tag(3, "br")}', True),
+    (f'"other", {entity_tag(3)}', True),
+    ('*', True),
+    (entity_tag(2), False),
+])
+def test_if_none_match(header, expected):
+    assert is_not_modified(request(**{'If-None-Match': header}), 3, UPDATED_DT) is expected
+
+
+def test_if_modified_since():
+    assert is_not_modified(request(**{'If-Modified-Since': format_datetime(UPDATED_DT, usegmt=True)}), 3, UPDATED_DT)
+    earlier = format_datetime(UPDATED_DT.replace(hour=11), usegmt=True)
+    assert not is_not_modified(request(**{'If-Modified-Since': earlier}), 3, UPDATED_DT)
+    assert not is_not_modified(request(**{'If-Modified-Since': 'garbage'}), 3, UPDATED_DT)
+
+
+def test_if_none_match_takes_precedence():
+    headers = {'If-None-Match': entity_tag(2), 'If-Modified-Since': format_datetime(UPDATED_DT, usegmt=True)}
+    assert not is_not_modified(request(**headers), 3, UPDATED_DT)
+
+
+def cached_request(**headers):
+    app = {
+        'page_cache': LRUCache(8),
+        'data_version_watcher': SimpleNamespace(version=3, updated_dt=UPDATED_DT),
+    }
+    return make_mocked_request('GET', '/', headers=headers, app=app)
+
+
+@pytest.mark.parametrize('body', [b'x', b'x' * MIN_COMPRESSED_SIZE])
+def test_not_modified_has_etag_of_the_body(body):
+    async def render():
+        return body
+
+    async def main():
+        response = await cached_response(cached_request(**{'Accept-Encoding': 'gzip'}), ('page',), 'text/html', render)
+        not_modified = await cached_response(cached_request(**{
+            'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag'],
+        }), ('page',), 'text/html', render)
+        return response, not_modified
+
+    response, not_modified = asyncio.run(main())
+    assert response.status == 200
+    assert not_modified.status == 304
+    assert not_modified.headers['ETag'] == response.headers['ETag']
+
+
+def test_missing_resource_is_not_found_for_conditional_requests():
+    async def render():
+        raise web.HTTPNotFound()
+
+    request = cached_request(**{'If-None-Match': entity_tag(3)})
+    with pytest.raises(web.HTTPNotFound):
+        asyncio.run(cached_response(request, ('record', 999999), 'application/json', render))
@@ -0,0 +1,133 @@
+import asyncio
+import pytest
+from aiogram import Bot, Dispatcher, types
+from winey.bot.sequencer import SequencedDispatcher, UpdateSequencer
+
+
+def test_jobs_with_the_same_key_run_in_order():
+    async def main():
+        sequencer = UpdateSequencer()
+        events = []
+
+        def job(name, delay):
+            async def run():
+                events.append(f'{name} started')
+                await asyncio.sleep(delay)
+                events.append(f'{name} finished')
+                return name
+            return run
+
+        results = await asyncio.gather(
+            sequencer.run('user', job('first', 0.02)),
+            sequencer.run('user', job('second', 0)),
+        )
+        assert results == ['first', 'second']
+        assert events == ['first started', 'first finished', 'second started', 'second finished']
+        assert sequencer.pending_count == 0
+
+    asyncio.run(main())
+
+
+def test_jobs_with_different_keys_run_concurrently():
+    async def main():
+        sequencer = UpdateSequencer(max_in_flight=2)
+        running = []
+
+        async def job():
+            running.append(sequencer.in_flight_count)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(sequencer.run('a', job), sequencer.run('b', job), sequencer.run('c', job))
+        assert max(running) == 2
+
+    asyncio.run(main())
+
+
+def test_failure_doesnt_stop_following_jobs():
+    async def main():
+        sequencer = UpdateSequencer()
+
+        async def fail():
+            raise ValueError
+
+        async def succeed():
+            return 'ok'
+
+        results = await asyncio.gather(sequencer.run('user', fail), sequencer.run('user', succeed),
+                                       return_exceptions=True)
+        assert isinstance(results[0], ValueError)
+        assert results[1] == 'ok'
+
+    asyncio.run(main())
+
+
+def test_drain_tasks_are_kept_until_done():
+    async def main():
+        sequencer = UpdateSequencer()
+        release = asyncio.Event()
+
+        running = asyncio.create_task(sequencer.run('user', release.wait))
+        await asyncio.sleep(0)
+        assert len(sequencer._draining) == 1
+        release.set()
+        await running
+        await asyncio.sleep(0)
+        assert not sequencer._draining
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('delay', [0, 0.01])
+def test_cancelled_drain_cancels_queued_jobs(delay):
+    async def main():
+        sequencer = UpdateSequencer(max_pending=2)
+
+        async def succeed():
+            return 'ok'
+
+        runs = [asyncio.create_task(sequencer.run('user', asyncio.Event().wait)) for _ in range(2)]
+        # with no delay the drain is cancelled before it has started
+        await asyncio.sleep(delay)
+        for draining in list(sequencer._draining):
+            draining.cancel()
+        results = await asyncio.gather(*runs, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert sequencer.pending_count == 0
+        # the slots are free again
+        assert await asyncio.wait_for(sequencer.run('user', succeed), 1) == 'ok'
+
+    asyncio.run(main())
+
+
+def test_polling_waits_for_room(monkeypatch):
+    async def main():
+        handling = asyncio.Event()
+        get_updates_calls = []
+
+        async def get_updates(self, *args, **kwargs):
+            get_updates_calls.append(kwargs['offset'])
+            # a real request yields to the event loop, polling would spin otherwise
+            await asyncio.sleep(0.01)
+            first_id = len(get_updates_calls) * 2
+            return [
+                types.Update(update_id=update_id, message={'from': {'id': update_id}})
+                for update_id in (first_id, first_id + 1)
+            ]
+
+        async def process_update(self, update):
+            await handling.wait()
+
+        monkeypatch.setattr(Bot, 'get_updates', get_updates)
+        monkeypatch.setattr(Dispatcher, 'process_update', process_update)
+        dp = SequencedDispatcher(Bot('123456:token'), sequencer=UpdateSequencer(max_pending=2))
+        polling = asyncio.create_task(dp.start_polling(reset_webhook=False, relax=0))
+        await asyncio.sleep(0.05)
+        assert get_updates_calls == [None]
+        handling.set()
+        await asyncio.sleep(0.05)
+        assert len(get_updates_calls) > 1
+        dp.stop_polling()
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+
+    asyncio.run(main())
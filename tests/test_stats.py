@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+import pytest
+from winey.db import OrmSession
+from winey.db.models import TastingRecord
+from winey.stats import add_to_stats, fetch_stats, rebuild_stats, split_grapes, stat_keys
+
+
+def tasting_record(user_id=1, dt=datetime(2021, 8, 1, tzinfo=timezone.utc), wine_name='Кьянти', region='Тоскана',
+                   grapes='Санджовезе', vintage_year=2018):
+    return TastingRecord(user_id=user_id, dt=dt, wine_name=wine_name, region=region, grapes=grapes,
+                         vintage_year=vintage_year, experience='Вишня')
+
+
+async def aiter(items):
+    for item in items:
+        yield item
+
+
+@pytest.mark.parametrize('grapes, expected', [
+    ('Каберне Совиньон 60%, Мерло и Каберне Фран', ['каберне совиньон', 'мерло', 'каберне фран']),
+    ('Syrah 85,5 % / Viognier', ['syrah', 'viognier']),
+    ('Гренаш; Сира + Мурведр & Карриньян', ['гренаш', 'сира', 'мурведр', 'карриньян']),
+    ('Пино Нуар - Шардоне', ['пино нуар', 'шардоне']),
+    # no splitting within hyphenated names and words containing the separators
+    ('Вионье-Шардоне, Пино Гриджио', ['вионье-шардоне', 'пино гриджио']),
+    ('-', []),
+    ('', []),
+])
+def test_split_grapes(grapes, expected):
+    assert split_grapes(grapes) == expected
+
+
+def test_stat_keys():
+    record = tasting_record(wine_name='  Кьянти   Классико ', grapes='Санджовезе, санджовезе 10%')
+    assert stat_keys(record) == [
+        ('total', ''),
+        ('region', 'тоскана'),
+        ('wine', 'кьянти классико'),
+        ('grape', 'санджовезе'),
+        ('decade', '2010'),
+        ('month', '2021-08'),
+    ]
+
+
+def test_stat_keys_skip_missing_values():
+    record = tasting_record(region=' ', grapes='-', vintage_year=None)
+    assert stat_keys(record) == [('total', ''), ('wine', 'кьянти'), ('month', '2021-08')]
+
+
+def test_rebuild_matches_incremental_stats(run_with_orm):
+    records = [
+        tasting_record(),
+        tasting_record(user_id=2, grapes='Санджовезе, Мерло'),
+        tasting_record(user_id=2, dt=datetime(2021, 9, 3, tzinfo=timezone.utc), region='Бордо', grapes='Мерло',
+                       vintage_year=2009),
+    ]
+
+    async def main():
+        async with OrmSession() as session:
+            await add_to_stats(session, *records[:2])
+            await add_to_stats(session, records[2])
+            await session.commit()
+            incremental = {user_id: await fetch_stats(session, user_id) for user_id in (0, 1, 2)}
+
+        async with OrmSession() as session:
+            assert await rebuild_stats(session, aiter(records)) == 3
+            await session.commit()
+            rebuilt = {user_id: await fetch_stats(session, user_id) for user_id in (0, 1, 2)}
+        return incremental, rebuilt
+
+    incremental, rebuilt = run_with_orm(main)
+    assert rebuilt == incremental
+    stats = rebuilt[0]
+    assert stats['total'] == 3
+    assert stats['grape'] == [('мерло', 2), ('санджовезе', 2)]
+    assert stats['region'] == [('тоскана', 2), ('бордо', 1)]
+    assert stats['decade'] == [('2010', 2), ('2000', 1)]
+    assert stats['month'] == [('2021-08', 2), ('2021-09', 1)]
+    assert rebuilt[1]['total'] == 1
+    assert rebuilt[2]['grape'] == [('мерло', 2), ('санджовезе', 1)]
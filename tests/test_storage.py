@@ -0,0 +1,71 @@
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from winey.bot.storage import DatabaseStorage
+
+
+CHAT = USER = 1
+
+
+class GatedCommitSession(AsyncSession):
+    """
+    Session announcing commits in `started` and holding them until `allowed` is set
+    """
+    started: asyncio.Queue
+    allowed: asyncio.Event
+
+    async def commit(self):
+        self.started.put_nowait(None)
+        await self.allowed.wait()
+        await super().commit()
+
+
+def test_changes_are_coalesced_and_persisted(database_uri):
+    async def main():
+        engine = create_async_engine(database_uri)
+        session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        storage = DatabaseStorage(session_factory, flush_delay=0.01)
+        await storage.set_state(chat=CHAT, user=USER, state='Form:photo')
+        await storage.update_data(chat=CHAT, user=USER, photo='p')
+        await storage.close()
+
+        storage = DatabaseStorage(session_factory)
+        assert await storage.get_state(chat=CHAT, user=USER) == 'Form:photo'
+        assert await storage.get_data(chat=CHAT, user=USER) == {'photo': 'p'}
+        await storage.reset_state(chat=CHAT, user=USER)
+        await storage.close()
+
+        storage = DatabaseStorage(session_factory)
+        assert await storage.get_state(chat=CHAT, user=USER) is None
+        assert await storage.get_data(chat=CHAT, user=USER) == {}
+        await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_changes_made_during_slow_flush_are_not_lost(database_uri):
+    async def main():
+        GatedCommitSession.started = asyncio.Queue()
+        GatedCommitSession.allowed = asyncio.Event()
+        engine = create_async_engine(database_uri)
+        session_factory = sessionmaker(engine, expire_on_commit=False, class_=GatedCommitSession)
+        storage = DatabaseStorage(session_factory, flush_delay=0.01)
+        await storage.update_data(chat=CHAT, user=USER, photo='p')
+        await GatedCommitSession.started.get()
+        # the first flush is committing now
+        await storage.update_data(chat=CHAT, user=USER, wine_name='x')
+        # waiters woken by set() aren't affected by clear(), so only the first commit goes through
+        GatedCommitSession.allowed.set()
+        GatedCommitSession.allowed.clear()
+        await GatedCommitSession.started.get()
+        # the first flush is over, the second one is committing
+        assert await storage.get_data(chat=CHAT, user=USER) == {'photo': 'p', 'wine_name': 'x'}
+        await storage.update_data(chat=CHAT, user=USER, region='r')
+        GatedCommitSession.allowed.set()
+        await storage.close()
+
+        storage = DatabaseStorage(session_factory)
+        assert await storage.get_data(chat=CHAT, user=USER) == {'photo': 'p', 'wine_name': 'x', 'region': 'r'}
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+from winey.throttling import RateLimiter
+
+
+def fake_clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('winey.throttling.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_allows_burst_then_refills(monkeypatch):
+    now = fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=3)
+    assert [limiter.acquire('user') for _ in range(4)] == [True, True, True, False]
+    now[0] += 1
+    assert limiter.acquire('user')
+    assert not limiter.acquire('user')
+
+
+def test_keys_are_limited_independently(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.acquire('a')
+    assert limiter.acquire('b')
+    assert not limiter.acquire('a')
+
+
+def test_failed_acquire_keeps_tokens(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=2)
+    assert not limiter.acquire('user', tokens=3)
+    assert limiter.acquire('user', tokens=2)
+
+
+def test_released_tokens_are_given_back(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=2)
+    assert limiter.acquire('user', tokens=2)
+    limiter.release('user')
+    assert limiter.acquire('user')
+    assert not limiter.acquire('user')
+    # never more than a burst
+    limiter.release('user', tokens=5)
+    assert limiter.acquire('user', tokens=2)
+    assert not limiter.acquire('user')
+
+
+def test_evicts_refilled_buckets(monkeypatch):
+    now = fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=2)
+    limiter.acquire('a')
+    limiter.acquire('b')
+    now[0] += 2
+    limiter.acquire('c')
+    assert len(limiter) == 1
+
+
+def test_max_size_bounds_memory(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = RateLimiter(rate=1, burst=10, max_size=2)
+    for key in 'abc':
+        limiter.acquire(key)
+    assert len(limiter) == 2
+
+
+def test_non_positive_rate_disables_limiting():
+    limiter = RateLimiter(rate=0, burst=1)
+    assert all(limiter.acquire('user') for _ in range(100))
+    assert len(limiter) == 0
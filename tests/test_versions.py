@@ -0,0 +1,21 @@
+from winey.db import OrmSession
+from winey.db.versions import bump_data_version, get_data_version
+
+
+def test_bump_data_version(run_with_orm):
+    async def main():
+        versions = []
+        for _ in range(3):
+            async with OrmSession() as session:
+                await bump_data_version(session)
+                await session.commit()
+                versions.append((await get_data_version(session))[0])
+        async with OrmSession() as session:
+            # rolled back bumps don't count
+            await bump_data_version(session)
+            await session.rollback()
+            versions.append((await get_data_version(session))[0])
+            assert await get_data_version(session, 'other') is None
+        return versions
+
+    assert run_with_orm(main) == [1, 2, 3, 3]
@@ -0,0 +1,13 @@
+from sqlalchemy.ext.asyncio import create_async_engine
+from winey.db.models import Base
+
+
+async def create_schema(database_uri):
+    """
+    Creates missing tables, enough for SQLite. PostgreSQL databases are expected to be migrated,
+    as some indexes and columns only exist in migrations
+    """
+    engine = create_async_engine(database_uri)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
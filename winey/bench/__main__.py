@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import logging
+import tempfile
+from . import bot, webapp
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m winey.bench',
+        description='Benchmarks of the new record conversation and of the wine log. '
+                    'Other WINEY_* environment variables (storage, worker counts, etc.) are honoured',
+    )
+    parser.add_argument('--database-uri', default=f'sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db',
+                        help='a fresh SQLite database by default, a PostgreSQL one should be migrated beforehand')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--log-level', default='WARNING')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    bot_parser = subparsers.add_parser('bot', help='N users walking /newrecord through to the impressions')
+    bot_parser.add_argument('--users', type=int, default=50)
+    bot_parser.add_argument('--records', type=int, default=2, help='conversations per user')
+    bot_parser.add_argument('--latency', type=float, default=0.0, help='fake Telegram and S3 latency, seconds')
+    bot_parser.add_argument('--album-size', type=int, default=1, help='photos sent with every record')
+    bot_parser.add_argument('--think-time', type=float, default=0.0, help='pause before every message, seconds')
+    bot_parser.add_argument('--drain-timeout', type=float, default=120)
+    bot_parser.add_argument('--telegram-port', type=int, default=8881)
+    bot_parser.add_argument('--s3-port', type=int, default=8882)
+    bot_parser.set_defaults(run=bot.run)
+
+    webapp_parser = subparsers.add_parser('webapp', help='load test of /wine-log at growing table sizes')
+    webapp_parser.add_argument('--sizes', type=lambda sizes: [int(size) for size in sizes.split(',')],
+                               default=[1000, 10000, 100000])
+    webapp_parser.add_argument('--requests', type=int, default=2000)
+    webapp_parser.add_argument('--concurrency', type=int, default=32)
+    webapp_parser.add_argument('--webapp-port', type=int, default=8883)
+    webapp_parser.set_defaults(run=webapp.run)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, force=True)
+    asyncio.run(args.run(args))
+
+
+if __name__ == '__main__':
+    main()
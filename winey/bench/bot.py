@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from aiogram import Bot, Dispatcher, types
+from sqlalchemy import func
+from sqlalchemy.future import select
+from winey.bot.app import create_dispatcher, on_startup, on_shutdown
+from winey.db import OrmSession
+from winey.db.models import PhotoUpload
+from . import create_schema
+from .fakes import start_fake_servers, wait_for_server
+from .stats import latency_table, peak_rss_mb
+
+
+log = logging.getLogger('winey.bench')
+
+STEPS = ('newrecord', 'photo', 'album_photo', 'wine_name', 'region', 'grapes', 'vintage_year', 'experience')
+FIRST_USER_ID = 10 ** 9
+
+
+def message_update(update_id, user_id, text=None, photo_id=None, media_group_id=None):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'Bench {user_id}'},
+    }
+    if photo_id is not None:
+        message['photo'] = [
+            {'file_id': f'{photo_id}_s', 'file_unique_id': f'{photo_id}_s', 'width': 320, 'height': 240},
+            {'file_id': photo_id, 'file_unique_id': photo_id, 'width': 1280, 'height': 960},
+        ]
+        if media_group_id is not None:
+            message['media_group_id'] = media_group_id
+    else:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return types.Update.to_object({'update_id': update_id, 'message': message})
+
+
+def conversation(update_ids, user_id, record, album_size=1):
+    """
+    Yields (step, update) pairs of one walk through the new record form,
+    with an album of `album_size` photos if it's more than one
+    """
+    yield 'newrecord', message_update(next(update_ids), user_id, '/newrecord')
+    media_group_id = f'bench_{user_id}_{record}' if album_size > 1 else None
+    for i in range(album_size):
+        yield 'album_photo' if i else 'photo', message_update(
+            next(update_ids), user_id, photo_id=f'bench_{user_id}_{record}_{i}', media_group_id=media_group_id
+        )
+    yield 'wine_name', message_update(next(update_ids), user_id, f'Бенчмарк Совиньон Блан {record}')
+    yield 'region', message_update(next(update_ids), user_id, 'Мальборо, Новая Зеландия')
+    yield 'grapes', message_update(next(update_ids), user_id, 'Совиньон Блан')
+    yield 'vintage_year', message_update(next(update_ids), user_id, str(2000 + record % 20))
+    yield 'experience', message_update(next(update_ids), user_id, 'Крыжовник, лайм и скошенная трава. ' * 5)
+
+
+async def simulate_user(dp, update_ids, user_id, records, latencies, think_time=0.0, album_size=1):
+    for record in range(records):
+        for step, update in conversation(update_ids, user_id, record, album_size):
+            # album parts are sent all at once
+            if step != 'album_photo':
+                await asyncio.sleep(think_time)
+            start = time.perf_counter()
+            await dp.process_update(update)
+            latencies[step].append(time.perf_counter() - start)
+
+
+async def count_pending_uploads():
+    async with OrmSession() as session:
+        return await session.scalar(
+            select(func.count()).select_from(PhotoUpload).where(PhotoUpload.status == PhotoUpload.PENDING)
+        )
+
+
+async def run(args):
+    """
+    Walks `args.users` simulated users through the new record form `args.records` times each
+    against fake Telegram and S3, then waits for the photo outbox to drain
+    """
+    fakes = start_fake_servers(args.host, args.telegram_port, args.s3_port, args.latency)
+    try:
+        await wait_for_server(args.host, args.telegram_port)
+        await wait_for_server(args.host, args.s3_port)
+        os.environ.update({
+            'WINEY_BOT_TOKEN': '123456:bench',
+            'WINEY_BOT_API_SERVER_URL': f'http://{args.host}:{args.telegram_port}',
+            'WINEY_S3_ENDPOINT_URL': f'http://{args.host}:{args.s3_port}',
+            'WINEY_S3_WINE_PHOTOS_BUCKET': 'bench',
+            'AWS_ACCESS_KEY_ID': 'bench',
+            'AWS_SECRET_ACCESS_KEY': 'bench',
+            'WINEY_DATABASE_URI': args.database_uri,
+        })
+        # simulated users answer instantly, so they would be throttled unless limits are set explicitly
+        os.environ.setdefault('WINEY_THROTTLE_USER_RATE', '0')
+        os.environ.setdefault('WINEY_THROTTLE_GLOBAL_RATE', '0')
+        await create_schema(args.database_uri)
+        dp = create_dispatcher()
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        await on_startup(dp)
+
+        latencies = {step: [] for step in STEPS if step != 'album_photo' or args.album_size > 1}
+        update_ids = itertools.count(int(time.time()))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(
+                dp, update_ids, FIRST_USER_ID + user, args.records, latencies, args.think_time, args.album_size
+            )
+            for user in range(args.users)
+        ))
+        conversations_elapsed = time.perf_counter() - start
+        while await count_pending_uploads():
+            if time.perf_counter() - start > conversations_elapsed + args.drain_timeout:
+                log.warning('Photo uploads did not drain in time')
+                break
+            await asyncio.sleep(0.05)
+        uploads_elapsed = time.perf_counter() - start
+
+        await on_shutdown(dp)
+        await (await dp.bot.get_session()).close()
+    finally:
+        fakes.terminate()
+
+    updates = sum(len(values) for values in latencies.values())
+    print(f'{args.users} users x {args.records} records, {updates} updates, database {args.database_uri}')
+    print(f'conversations: {conversations_elapsed:.2f} s, {updates / conversations_elapsed:.1f} updates/s')
+    print(f'photo uploads drained: {uploads_elapsed:.2f} s, '
+          f'{args.users * args.records / uploads_elapsed:.1f} records/s end to end')
+    print(f'peak RSS: {peak_rss_mb():.1f} MB')
+    print(latency_table(latencies))
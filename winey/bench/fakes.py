@@ -0,0 +1,155 @@
+import asyncio
+import io
+import itertools
+import multiprocessing
+import time
+import uuid
+from aiohttp import web
+from PIL import Image
+
+
+def make_jpeg(width=1280, height=960):
+    """
+    Noisy picture of about the size of a phone photo sent to a bot, flat colour would compress to nothing
+    """
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def fake_telegram_app(photo: bytes, latency=0.0):
+    """
+    Bot API answering every method the bot uses with a plausible result after `latency` seconds.
+    Every file is served as `photo` followed by its path, so files have distinct content,
+    but are still valid JPEGs
+    """
+    message_ids = itertools.count(1)
+
+    async def call_method(request):
+        method = request.match_info['method']
+        payload = dict(await request.post()) if request.body_exists else {}
+        await asyncio.sleep(latency)
+        if method == 'getFile':
+            file_id = payload.get('file_id', 'file')
+            result = {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(photo),
+                'file_path': f'photos/{file_id}.jpg',
+            }
+        elif method == 'getUpdates':
+            # nobody writes to the fake, long polling just times out
+            await asyncio.sleep(min(float(payload.get('timeout', 0)), 1))
+            result = []
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Winey', 'username': 'winey_bench_bot'}
+        elif method in ('sendMessage', 'sendDocument'):
+            result = {
+                'message_id': next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(payload.get('chat_id', 0)), 'type': 'private'},
+                'text': payload.get('text', ''),
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def download_file(request):
+        await asyncio.sleep(latency)
+        return web.Response(body=photo + request.match_info['path'].encode(), content_type='image/jpeg')
+
+    app = web.Application(client_max_size=2 ** 26)
+    app.router.add_post('/bot{token}/{method}', call_method)
+    app.router.add_get('/file/bot{token}/{path:.*}', download_file)
+    return app
+
+
+def fake_s3_app(latency=0.0):
+    """
+    Path-style S3 keeping only sizes of stored objects, enough for uploads including multipart ones
+    """
+    objects = {}
+    multipart_uploads = {}
+
+    async def handle(request):
+        key = request.match_info['key']
+        query = request.query
+        await asyncio.sleep(latency)
+        if request.method == 'POST' and 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            multipart_uploads[upload_id] = 0
+            return web.Response(
+                text='<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                     f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>',
+                content_type='application/xml',
+            )
+        if request.method == 'POST' and 'uploadId' in query:
+            objects[key] = multipart_uploads.pop(query['uploadId'])
+            return web.Response(
+                text='<CompleteMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                     '</CompleteMultipartUploadResult>',
+                content_type='application/xml',
+            )
+        if request.method == 'PUT':
+            size = 0
+            async for chunk in request.content.iter_any():
+                size += len(chunk)
+            if 'uploadId' in query:
+                multipart_uploads[query['uploadId']] += size
+                return web.Response(headers={'ETag': f'"{uuid.uuid4().hex}"'})
+            objects[key] = size
+            return web.Response(headers={'ETag': f'"{uuid.uuid4().hex}"'})
+        if request.method == 'DELETE':
+            if 'uploadId' in query:
+                multipart_uploads.pop(query['uploadId'], None)
+            else:
+                objects.pop(key, None)
+            return web.Response(status=204)
+        if key not in objects:
+            return web.Response(status=404)
+        return web.Response(body=bytes(objects[key]))
+
+    app = web.Application(client_max_size=2 ** 30)
+    app.router.add_route('*', '/{bucket}/{key:.*}', handle)
+    return app
+
+
+def _serve(host, telegram_port, s3_port, latency):
+    async def serve():
+        runners = []
+        for app, port in ((fake_telegram_app(make_jpeg(), latency), telegram_port), (fake_s3_app(latency), s3_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            runners.append(runner)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def start_fake_servers(host='127.0.0.1', telegram_port=8881, s3_port=8882, latency=0.0):
+    """
+    Runs fake Telegram and S3 in a separate process, so they don't skew CPU and memory figures
+    of the process being measured
+    """
+    process = multiprocessing.Process(target=_serve, args=(host, telegram_port, s3_port, latency), daemon=True)
+    process.start()
+    return process
+
+
+async def wait_for_server(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
@@ -0,0 +1,45 @@
+import resource
+import sys
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of already sorted values
+    """
+    if not sorted_values:
+        return float('nan')
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb(pid=None):
+    """
+    Peak resident set size of the current process or, on Linux only, of process `pid`
+    """
+    if pid is not None:
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 2 ** 10
+        except OSError:
+            pass
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def latency_table(latencies):
+    """
+    Formats {name: [seconds]} as a table of count and p50/p95/p99/max in milliseconds
+    """
+    lines = [f'{"":<16}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+    for name, values in latencies.items():
+        values = sorted(values)
+        lines.append(
+            f'{name:<16}{len(values):>8}'
+            + ''.join(f'{percentile(values, p) * 1000:>10.1f}' for p in (50, 95, 99))
+            + f'{(values[-1] if values else float("nan")) * 1000:>10.1f}'
+        )
+    return '\n'.join(lines)
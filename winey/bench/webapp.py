@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import aiohttp
+from sqlalchemy import func
+from sqlalchemy.future import select
+from winey.db import OrmSession, init_orm, close_orm
+from winey.db.dialects import dialect_insert
+from winey.db.models import User, TastingRecord, WinePhoto
+from winey.db.queries import encode_cursor
+from . import create_schema
+from .fakes import wait_for_server
+from .stats import latency_table, peak_rss_mb
+
+
+REPOSITORY_ROOT = Path(__file__).resolve().parents[2]
+BENCH_USER_ID = 10 ** 9 - 1
+WINE_NAMES = ('Риоха Резерва', 'Кьянти Классико', 'Шабли Премьер Крю', 'Бароло', 'Приорат', 'Мозель Рислинг')
+REGIONS = ('Испания', 'Италия', 'Франция', 'Германия', 'Португалия')
+GRAPES = ('Темпранильо', 'Санджовезе', 'Шардоне', 'Неббиоло', 'Гренаш', 'Рислинг')
+SEED_BATCH_SIZE = 1000
+
+
+async def seed(session_factory, size):
+    """
+    Tops tasting_records up to `size` rows, existing rows are left untouched
+    """
+    async with session_factory() as session:
+        await session.execute(
+            dialect_insert(session, User)
+            .values(id=BENCH_USER_ID, first_name='Bench', joined_dt=datetime.now(timezone.utc))
+            .on_conflict_do_nothing(index_elements=[User.id])
+        )
+        existing = await session.scalar(select(func.count()).select_from(TastingRecord))
+        start_dt = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        for batch_start in range(existing, size, SEED_BATCH_SIZE):
+            for i in range(batch_start, min(size, batch_start + SEED_BATCH_SIZE)):
+                session.add(TastingRecord(
+                    user_id=BENCH_USER_ID,
+                    dt=start_dt + timedelta(minutes=i),
+                    wine_name=f'{random.choice(WINE_NAMES)} {i}',
+                    region=random.choice(REGIONS),
+                    grapes=random.choice(GRAPES),
+                    vintage_year=random.randint(1990, 2020),
+                    experience='Вишня, табак и немного кожи, долгое послевкусие. ' * 3,
+                    photos=[WinePhoto(
+                        id=f'bench_{i}',
+                        object_key=f'bench/{i}.jpg',
+                        variants={'original': 1280, 'thumb': 320, 'card': 800},
+                    )],
+                ))
+            await session.commit()
+
+
+async def sample_cursors(session_factory, count):
+    async with session_factory() as session:
+        rows = await session.execute(select(TastingRecord.id, TastingRecord.dt).order_by(func.random()).limit(count))
+        return [encode_cursor(TastingRecord(id=record_id, dt=dt)) for record_id, dt in rows]
+
+
+def request_kinds(cursors):
+    """
+    Request mix of the load test: name -> (path, params, headers) factory
+    """
+    etag = {}
+
+    def revalidate():
+        return '/wine-log', {}, {'If-None-Match': etag.get('value', '"none"')}
+
+    return {
+        'first_page': lambda: ('/wine-log', {}, {}),
+        'deep_page': lambda: ('/wine-log', {'before': random.choice(cursors)}, {}),
+        'search': lambda: ('/wine-log', {'q': random.choice(WINE_NAMES).split()[0]}, {}),
+        'api_page': lambda: ('/api/v1/tasting-records', {'before': random.choice(cursors)}, {}),
+        'revalidate': revalidate,
+    }, etag
+
+
+async def load(base_url, kinds, etag, requests, concurrency):
+    latencies = {name: [] for name in kinds}
+    statuses = {}
+    counter = itertools.count()
+    names = list(kinds)
+
+    async def worker(session):
+        while next(counter) < requests:
+            name = random.choice(names)
+            path, params, headers = kinds[name]()
+            start = time.perf_counter()
+            async with session.get(base_url + path, params=params, headers=headers) as response:
+                await response.read()
+            latencies[name].append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if name == 'first_page' and 'ETag' in response.headers:
+                etag['value'] = response.headers['ETag']
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers={'Accept-Encoding': 'gzip, br'}) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, statuses
+
+
+async def run(args):
+    """
+    Load tests /wine-log served by a separate webapp process for every table size of `args.sizes`
+    """
+    os.environ['WINEY_DATABASE_URI'] = args.database_uri
+    await create_schema(args.database_uri)
+    init_orm()
+    for size in sorted(args.sizes):
+        seed_start = time.perf_counter()
+        await seed(OrmSession, size)
+        cursors = await sample_cursors(OrmSession, 500)
+        print(f'\n{size} tasting records (seeded in {time.perf_counter() - seed_start:.1f} s)')
+
+        webapp = subprocess.Popen(
+            [sys.executable, '-m', 'winey.webapp'],
+            cwd=REPOSITORY_ROOT,
+            env={**os.environ, 'WINEY_WEBAPP_PORT': str(args.webapp_port)},
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            await wait_for_server(args.host, args.webapp_port)
+            kinds, etag = request_kinds(cursors)
+            elapsed, latencies, statuses = await load(
+                f'http://{args.host}:{args.webapp_port}', kinds, etag, args.requests, args.concurrency
+            )
+            webapp_rss = peak_rss_mb(webapp.pid)
+        finally:
+            webapp.terminate()
+            webapp.wait()
+        print(f'{args.requests} requests, concurrency {args.concurrency}: {elapsed:.2f} s, '
+              f'{args.requests / elapsed:.1f} requests/s, statuses {statuses}, webapp peak RSS {webapp_rss:.1f} MB')
+        print(latency_table(latencies))
+    await close_orm()
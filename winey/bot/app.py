@@ -0,0 +1,137 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.contrib.middlewares.logging import LoggingMiddleware
+from winey.db import OrmSession, init_orm, close_orm
+from winey.metrics import CallbackMetric, start_metrics_server
+from winey.s3 import S3Client
+from winey.startup import StartupTimer
+from .handlers import register_handlers
+from .middleware import MetricsMiddleware, PrivateChatOnlyMiddleware, ThrottlingMiddleware, GetOrCreateUserMiddleware
+from .outbox import PhotoUploadWorkerPool
+from .prefetch import PhotoPrefetcher
+from .sequencer import SequencedDispatcher, UpdateSequencer
+from .storage import DatabaseStorage
+
+
+log = logging.getLogger('winey.bot')
+
+
+def create_dispatcher(startup_timer: StartupTimer = None):
+    """
+    Builds the dispatcher with its handlers and middlewares. Nothing is connected here:
+    the database engine, S3 client and photo upload workers are created by `on_startup`
+    and closed by `on_shutdown`, which have to be registered with the executor
+    """
+    api_server_url = os.environ.get('WINEY_BOT_API_SERVER_URL')
+    bot = Bot(
+        token=os.environ['WINEY_BOT_TOKEN'],
+        server=TelegramAPIServer.from_base(api_server_url) if api_server_url else TELEGRAM_PRODUCTION,
+    )
+    if os.environ.get('WINEY_STATE_STORAGE', 'database') == 'memory':
+        storage = MemoryStorage()
+    else:
+        storage = DatabaseStorage(
+            OrmSession,
+            flush_delay=float(os.environ.get('WINEY_STATE_STORAGE_FLUSH_DELAY', 0.1)),
+            ttl=float(os.environ.get('WINEY_STATE_STORAGE_TTL', 7 * 24 * 3600)),
+        )
+    sequencer = UpdateSequencer(
+        max_in_flight=int(os.environ.get('WINEY_BOT_MAX_IN_FLIGHT', 32)),
+        max_pending=int(os.environ.get('WINEY_BOT_MAX_PENDING', 1024)),
+    )
+    dp = SequencedDispatcher(bot, storage=storage, sequencer=sequencer)
+    dp['startup_timer'] = startup_timer or StartupTimer()
+    CallbackMetric('winey_bot_updates_in_flight', 'Updates being handled right now', lambda: sequencer.in_flight_count)
+    CallbackMetric('winey_bot_updates_pending', 'Updates waiting to be handled', lambda: sequencer.pending_count)
+    setup_middlewares(dp)
+    register_handlers(dp)
+    dp['startup_timer'].mark('dispatcher')
+    return dp
+
+
+def setup_middlewares(dp: Dispatcher):
+    user_middleware = GetOrCreateUserMiddleware(
+        cache_size=int(os.environ.get('WINEY_USER_CACHE_SIZE', 1024)),
+        cache_ttl=float(os.environ.get('WINEY_USER_CACHE_TTL', 600)),
+    )
+    CallbackMetric('winey_user_cache_hits', 'Users found in cache', lambda: user_middleware.users.hits, 'counter')
+    CallbackMetric('winey_user_cache_misses', 'Users not found in cache', lambda: user_middleware.users.misses, 'counter')
+    dp.middleware.setup(LoggingMiddleware(log))
+    dp.middleware.setup(MetricsMiddleware())
+    dp.middleware.setup(PrivateChatOnlyMiddleware())
+    dp.middleware.setup(ThrottlingMiddleware(
+        user_rate=float(os.environ.get('WINEY_THROTTLE_USER_RATE', 1)),
+        user_burst=int(os.environ.get('WINEY_THROTTLE_USER_BURST', 10)),
+        global_rate=float(os.environ.get('WINEY_THROTTLE_GLOBAL_RATE', 100)),
+        global_burst=int(os.environ.get('WINEY_THROTTLE_GLOBAL_BURST', 200)),
+    ))
+    dp.middleware.setup(user_middleware)
+
+
+async def on_startup(dp: Dispatcher):
+    startup_timer = dp['startup_timer']
+    init_orm()
+    startup_timer.mark('database')
+    dp['s3client'] = S3Client.from_environment(
+        os.environ['WINEY_S3_ENDPOINT_URL'],
+        os.environ['WINEY_S3_WINE_PHOTOS_BUCKET'],
+        max_concurrency=int(os.environ.get('WINEY_S3_MAX_CONCURRENCY', 4)),
+    )
+    startup_timer.mark('s3')
+    dp['process_pool'] = ProcessPoolExecutor(int(os.environ.get('WINEY_IMAGE_WORKERS', 2)))
+    dp['photo_uploads'] = PhotoUploadWorkerPool(
+        dp.bot,
+        dp['s3client'],
+        dp['process_pool'],
+        workers=int(os.environ.get('WINEY_PHOTO_UPLOAD_WORKERS', 4)),
+        batch_size=int(os.environ.get('WINEY_PHOTO_UPLOAD_BATCH_SIZE', 16)),
+        max_attempts=int(os.environ.get('WINEY_PHOTO_UPLOAD_MAX_ATTEMPTS', 8)),
+    )
+    await dp['photo_uploads'].start()
+    dp['photo_prefetch'] = PhotoPrefetcher(
+        dp.bot,
+        dp['s3client'],
+        dp['process_pool'],
+        max_tasks=int(os.environ.get('WINEY_PHOTO_PREFETCH_MAX_TASKS', 64)),
+        concurrency=int(os.environ.get('WINEY_PHOTO_PREFETCH_CONCURRENCY', 4)),
+        wait_timeout=float(os.environ.get('WINEY_PHOTO_PREFETCH_WAIT', 1)),
+        timeout=float(os.environ.get('WINEY_PHOTO_PREFETCH_TIMEOUT', 60)),
+        sweep_interval=float(os.environ.get('WINEY_PHOTO_PREFETCH_SWEEP_INTERVAL', 3600)),
+    )
+    startup_timer.mark('photo uploads')
+
+
+async def on_startup_polling(dp: Dispatcher):
+    metrics_port = os.environ.get('WINEY_BOT_METRICS_PORT')
+    if metrics_port:
+        dp['metrics_runner'] = await start_metrics_server('0.0.0.0', int(metrics_port))
+
+
+async def register_webhook(dp: Dispatcher):
+    await dp.bot.set_webhook(
+        os.environ['WINEY_BOT_WEBHOOK_URL'],
+        max_connections=int(os.environ.get('WINEY_BOT_WEBHOOK_MAX_CONNECTIONS', 40)),
+        secret_token=os.environ.get('WINEY_BOT_WEBHOOK_SECRET_TOKEN'),
+    )
+
+
+async def report_startup(dp: Dispatcher):
+    dp['startup_timer'].mark('webhook' if os.environ.get('WINEY_BOT_WEBHOOK_URL') else 'polling setup')
+    dp['startup_timer'].report('Bot')
+
+
+async def on_shutdown(dp: Dispatcher):
+    if 'photo_uploads' in dp.data:
+        await dp['photo_prefetch'].stop()
+        await dp['photo_uploads'].stop()
+        await dp['s3client'].close()
+        dp['process_pool'].shutdown()
+    if 'metrics_runner' in dp.data:
+        await dp['metrics_runner'].cleanup()
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    await close_orm()
@@ -0,0 +1,371 @@
+import asyncio
+import tempfile
+from datetime import datetime, timezone
+import aiogram.utils.markdown as md
+from aiogram.utils.emoji import emojize
+from aiogram.utils.text_decorations import markdown_decoration
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters import Text
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types import ParseMode
+from sqlalchemy.future import select
+from winey.db import OrmSession
+from winey.db.queries import fetch_tasting_records_page, stream_tasting_records
+from winey.export import FORMATS as EXPORT_FORMATS, export_chunks
+from winey.images import PHOTOS_BASE_URL
+from winey.stats import ALL_USERS, TOTAL, REGION, GRAPE, DECADE, WINE, MONTH, add_to_stats, fetch_stats
+from winey.db.versions import bump_data_version
+from winey.db.models import User, TastingRecord, WinePhoto, PhotoUpload, PhotoBlob
+
+
+SEARCH_RESULTS_LIMIT = 10
+# Telegram albums have at most 10 items
+MAX_PHOTOS = 10
+
+
+# States
+class Form(StatesGroup):
+    photo = State()
+    wine_name = State()
+    region = State()
+    grapes = State()
+    vintage_year = State()
+    experience = State()
+
+
+async def cmd_start(message: types.Message, user: User, is_new_user: bool):
+    """
+    Conversation's entry point
+    """
+    if is_new_user:
+        await message.answer(
+            emojize(md.text(
+                md.text('Привет, меня зовут Уайни.'),
+                md.text('Позовите меня с помощью команды /newrecord, '
+                        'когда в следующий раз будете хорошо проводить время за бокалом вина.'),
+                md.text('Я помогу вам запомнить, что это было за вино и какие ощущения у вас были по этому поводу, '
+                        'а от вас протребуется только:'),
+                md.text(':camera_with_flash: Сфотографировать этикетку'),
+                md.text(':grapes: Сообщить название вина, регион его происхождения, сортовой состав и год урожая'),
+                md.text(':wine_glass: В свободной форме рассказать о собственных ощущениях, ассоциациях... '
+                        'Все, что приходит на ум'),
+                md.text(''),
+                md.text('Пришлите команду /cancel или одно слово "Отмена", если передумали что-либо записывать.'),
+                md.text(''),
+                md.text('Ну и заходите как-нибудь ко мне на сайт -',
+                        markdown_decoration.link('winey.fun', 'https://winey.fun')),
+                sep='\n',
+            )),
+            parse_mode=ParseMode.MARKDOWN,
+        )
+    else:
+        await message.answer(f'Привет, {user.first_name}, приятно получать от вас новые сообщения. '
+                             'Я пока умею не так уж много чего, но могу рассказать с помощью команды /help.')
+
+
+async def cmd_help(message: types.Message):
+    await message.answer(
+        emojize(md.text(
+            md.text('Мое имя Уайни. И вот, что я умею:'),
+            md.text(''),
+            md.text('/newrecord - с помощью этой команды я помогу вам запомнить, '
+                    'что это было за вино и какие ощущения у вас были по этому поводу'),
+            md.text('В ответ я попрошу:'),
+            md.text(':camera_with_flash: Сфотографировать этикетку'),
+            md.text(':grapes: Сообщить название вина, регион его происхождения, сортовой состав и год урожая'),
+            md.text(':wine_glass: В свободной форме рассказать о собственных ощущениях, ассоциациях... '
+                    'Все, что приходит на ум'),
+            md.text(''),
+            md.text('/cancel или одно слово "Отмена" - так можно мне сообщить, если передумали что-либо записывать.'),
+            md.text(''),
+            md.text('/search и несколько слов - так я найду ваши записи по названию, региону, '
+                    'сортам винограда или ощущениям'),
+            md.text(''),
+            md.text('/export - выгружу все ваши записи файлом CSV, а /export jsonl - в формате JSON Lines'),
+            md.text(''),
+            md.text('/stats - расскажу, какие регионы, сорта и урожаи вам попадаются чаще всего'),
+            md.text(''),
+            md.text('Мой сайт -', markdown_decoration.link('winey.fun', 'https://winey.fun')),
+            sep='\n',
+        )),
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+
+async def cmd_newrecord(message: types.Message):
+    """
+    Conversation's entry point
+    """
+    await Form.photo.set()
+    await message.reply('Сфотографируйте, пожалуйста, бутылку, чтобы была видна этикетка')
+
+
+async def cancel_newrecord(message: types.Message, state: FSMContext):
+    current_state = await state.get_state()
+    if current_state is None:
+        await message.answer('В данный момент вы ничего не просили записывать')
+    else:
+        Dispatcher.get_current()['photo_prefetch'].discard((state.chat, state.user))
+        await state.finish()
+        await message.reply('Ладно, не в этот раз')
+
+
+async def cmd_search(message: types.Message, user: User):
+    query = message.get_args().strip()
+    if not query:
+        await message.reply('Напишите после команды, что нужно найти, например: /search Риоха')
+        return
+    async with OrmSession() as session:
+        tasting_records, next_cursor = await fetch_tasting_records_page(
+            session, SEARCH_RESULTS_LIMIT, query=query, user_id=user.id
+        )
+    if not tasting_records:
+        await message.reply('Ничего не нашлось')
+        return
+    await message.reply('\n'.join(
+        [f'Нашлось{" больше" if next_cursor else ""} {len(tasting_records)}:'] + [
+            f'{tasting_record.dt:%d.%m.%Y} {tasting_record.wine_name} ({tasting_record.region}'
+            f'{", " + str(tasting_record.vintage_year) if tasting_record.vintage_year else ""})'
+            for tasting_record in tasting_records
+        ]
+    ))
+
+
+async def cmd_export(message: types.Message, user: User):
+    export_format = message.get_args().strip().lower() or 'csv'
+    if export_format not in EXPORT_FORMATS:
+        await message.reply(f'Могу выгрузить записи в форматах {", ".join(EXPORT_FORMATS)}, например: /export jsonl')
+        return
+    async with OrmSession() as session:
+        tasting_records, _ = await fetch_tasting_records_page(session, 1, user_id=user.id)
+    if not tasting_records:
+        await message.reply('Пока нечего выгружать, начните с команды /newrecord')
+        return
+    await types.ChatActions.upload_document()
+    loop = asyncio.get_running_loop()
+    # spooled to disk, so memory use doesn't depend on the length of the history
+    with tempfile.TemporaryFile() as file:
+        async with OrmSession() as session:
+            chunks = export_chunks(stream_tasting_records(session, user.id), export_format, PHOTOS_BASE_URL)
+            async for chunk in chunks:
+                await loop.run_in_executor(None, file.write, chunk)
+        await loop.run_in_executor(None, file.seek, 0)
+        await message.reply_document(
+            types.InputFile(file, filename=f'winey-{datetime.now():%Y-%m-%d}.{export_format}'),
+            caption='Все ваши записи',
+        )
+
+
+async def cmd_stats(message: types.Message, user: User):
+    everyone = message.get_args().strip().lower() in ('all', 'все')
+    async with OrmSession() as session:
+        stats = await fetch_stats(session, ALL_USERS if everyone else user.id)
+    if not stats[TOTAL]:
+        await message.reply('Пока нечего считать, начните с команды /newrecord')
+        return
+
+    def top(dimension, label=lambda value: value[:1].upper() + value[1:]):
+        return ', '.join(f'{label(value)} ({count})' for value, count in stats[dimension])
+
+    lines = [
+        f'{"Всего записей у всех" if everyone else "Всего записей"}: {stats[TOTAL]}',
+        f'Регионы: {top(REGION)}',
+        f'Сорта винограда: {top(GRAPE)}',
+        f'Урожаи: {top(DECADE, lambda decade: f"{decade}-е")}',
+        f'Чаще всего: {top(WINE)}',
+        'По месяцам: ' + ', '.join(f'{month} - {count}' for month, count in stats[MONTH]),
+    ]
+    if not everyone:
+        lines.append('Статистика по всем пользователям: /stats все')
+    await message.reply('\n'.join(line for line in lines if not line.endswith(': ')))
+
+
+def photo_data(message: types.Message):
+    largest = max(message.photo, key=lambda photo: photo.width)
+    return {
+        'id': f'{message.date:%Y%m%d_%H%M%S}_{largest.file_unique_id}',
+        'file_id': largest.file_id,
+        'file_unique_id': largest.file_unique_id,
+    }
+
+
+def conversation_photos(data):
+    if 'photos' in data:
+        return data['photos']
+    # conversations started before albums were supported have a single photo,
+    # the ones started before photos became content addressed have s3_obj_key instead of its id
+    return [{
+        'id': data['photo_id'] if 'photo_id' in data else data['s3_obj_key'],
+        'file_id': data['photo_file_id'],
+        'file_unique_id': data.get('photo_file_unique_id'),
+    }]
+
+
+async def process_photo(message: types.Message, state: FSMContext):
+    photo = photo_data(message)
+    prefetch = Dispatcher.get_current()['photo_prefetch']
+    # leftovers of a conversation which was never finished
+    prefetch.discard((state.chat, state.user))
+    # photos are stored while the user answers the rest of the questions
+    prefetch.start((state.chat, state.user), photo['file_id'], photo['file_unique_id'])
+    await state.update_data(photos=[photo], media_group_id=message.media_group_id)
+    await Form.next()
+    await message.reply('Как называется вино?')
+
+
+async def process_album_photo(message: types.Message, state: FSMContext):
+    """
+    The rest of an album comes as separate messages right after the first photo, which has already moved
+    the conversation on, they are collected in the conversation's data
+    """
+    async with state.proxy() as data:
+        if message.media_group_id != data.get('media_group_id') or len(data['photos']) >= MAX_PHOTOS:
+            return
+        photo = photo_data(message)
+        if any(known['file_unique_id'] == photo['file_unique_id'] for known in data['photos']):
+            return
+        data['photos'] = data['photos'] + [photo]
+    Dispatcher.get_current()['photo_prefetch'].start(
+        (state.chat, state.user), photo['file_id'], photo['file_unique_id']
+    )
+
+
+async def process_wine_name(message: types.Message, state: FSMContext):
+    await state.update_data(wine_name=message.text)
+    await Form.next()
+    await message.reply('Какой у него регион происхождения?')
+
+
+async def process_region(message: types.Message, state: FSMContext):
+    await state.update_data(region=message.text)
+    await Form.next()
+    await message.reply('Из каких сортов винограда оно сделано?')
+
+
+async def process_grapes(message: types.Message, state: FSMContext):
+    await state.update_data(grapes=message.text)
+    await Form.next()
+    await message.reply('Из винограда какого года урожая оно сделано? '
+                        'В сообщении должны быть только цифры, либо пришлите дефис, если информации нет')
+
+
+async def process_empty_vintage_year(message: types.Message):
+    await Form.next()
+    await message.reply('Наконец, какие ваши ощущения? Пишите свободно.')
+
+
+async def process_vintage_year(message: types.Message, state: FSMContext):
+    year = int(message.text)
+    current_year = datetime.now().year
+    if year > current_year:
+        await message.reply(f'На дворе {current_year}, а вы написали {year}... '
+                            'Что-то здесь не так, повторите, пожалуйста')
+    else:
+        await state.update_data(vintage_year=year)
+        await Form.next()
+        await message.reply('Наконец, какие ваши ощущения? Пишите свободно.')
+
+
+async def process_vintage_year_invalid(message: types.Message):
+    await message.reply('Извините, в сообщении должны быть только цифры, либо пришлите дефис, если информации нет')
+
+
+async def process_experience(message: types.Message, state: FSMContext):
+    sender = message.from_user
+    dt = message.date
+    async with state.proxy() as data:
+        data['experience'] = message.text
+        photos = conversation_photos(data)
+        file_unique_ids = [photo['file_unique_id'] for photo in photos if photo['file_unique_id'] is not None]
+        blobs, deadlines = await Dispatcher.get_current()['photo_prefetch'].claim(
+            (state.chat, state.user), file_unique_ids
+        )
+
+        async with OrmSession() as session:
+            missing = [file_unique_id for file_unique_id in file_unique_ids if file_unique_id not in blobs]
+            if missing:
+                select_stmt = select(PhotoBlob).where(PhotoBlob.telegram_file_unique_id.in_(missing))
+                blobs.update(
+                    (blob.telegram_file_unique_id, blob) for blob in (await session.execute(select_stmt)).scalars()
+                )
+            wine_photos = []
+            now = datetime.now(timezone.utc)
+            for position, photo in enumerate(photos):
+                blob = blobs.get(photo['file_unique_id'])
+                if blob is not None:
+                    # the same file has already been stored, there is nothing to upload
+                    wine_photos.append(WinePhoto(
+                        id=photo['id'], position=position,
+                        object_key=blob.object_key, variants=blob.variants, is_uploaded=True,
+                    ))
+                    continue
+                wine_photo = WinePhoto(id=photo['id'], position=position, is_uploaded=False)
+                session.add(PhotoUpload(
+                    photo=wine_photo,
+                    telegram_file_id=photo['file_id'],
+                    telegram_file_unique_id=photo['file_unique_id'],
+                    # files still being prefetched are either stored or left to the outbox by the deadline
+                    next_attempt_dt=deadlines.get(photo['file_unique_id'], now),
+                    created_dt=now,
+                ))
+                wine_photos.append(wine_photo)
+            tasting_record = TastingRecord(
+                user_id=sender.id,
+                dt=dt,
+                wine_name=data['wine_name'],
+                region=data['region'],
+                grapes=data['grapes'],
+                vintage_year=data.get('vintage_year'),
+                experience=data['experience'],
+            )
+            tasting_record.photos.extend(wine_photos)
+            session.add(tasting_record)
+            await add_to_stats(session, tasting_record)
+            await bump_data_version(session)
+            await session.commit()
+        if any(photo['file_unique_id'] not in blobs and photo['file_unique_id'] not in deadlines for photo in photos):
+            Dispatcher.get_current()['photo_uploads'].wake_up()
+
+        await message.answer(
+            md.text(
+                md.text('Готово, информация в базе'),
+                md.text('Для просмотра переходите на', markdown_decoration.link('winey.fun', 'https://winey.fun')),
+                sep='\n',
+            ),
+            parse_mode=ParseMode.MARKDOWN,
+        )
+    await state.finish()
+
+
+def register_handlers(dp: Dispatcher):
+    dp.register_message_handler(cmd_start, commands='start')
+    dp.register_message_handler(cmd_help, commands='help')
+    dp.register_message_handler(cmd_newrecord, commands='newrecord')
+    dp.register_message_handler(cancel_newrecord, commands='cancel', state='*')
+    dp.register_message_handler(cancel_newrecord, Text(equals='отмена', ignore_case=True), state='*')
+    dp.register_message_handler(cmd_search, commands='search')
+    dp.register_message_handler(cmd_export, commands='export')
+    dp.register_message_handler(cmd_stats, commands='stats')
+    dp.register_message_handler(process_photo, content_types=types.ContentTypes.PHOTO, state=Form.photo)
+    dp.register_message_handler(
+        process_album_photo,
+        lambda message: message.media_group_id is not None,
+        content_types=types.ContentTypes.PHOTO,
+        state=[state for state in Form.states if state != Form.photo],
+    )
+    dp.register_message_handler(process_wine_name, content_types=types.ContentTypes.TEXT, state=Form.wine_name)
+    dp.register_message_handler(process_region, content_types=types.ContentTypes.TEXT, state=Form.region)
+    dp.register_message_handler(process_grapes, content_types=types.ContentTypes.TEXT, state=Form.grapes)
+    dp.register_message_handler(
+        process_empty_vintage_year, Text(equals='-', ignore_case=True), state=Form.vintage_year
+    )
+    dp.register_message_handler(
+        process_vintage_year, lambda message: message.text.isdigit(), state=Form.vintage_year
+    )
+    dp.register_message_handler(
+        process_vintage_year_invalid,
+        lambda message: not message.text.isdigit() and message.text != '-',
+        state=Form.vintage_year,
+    )
+    dp.register_message_handler(process_experience, content_types=types.ContentTypes.TEXT, state=Form.experience)
@@ -1,16 +1,39 @@
 import logging
+import time
 from aiogram import types
 from aiogram.dispatcher.filters import ChatTypeFilter
 from aiogram.dispatcher.middlewares import BaseMiddleware, LifetimeControllerMiddleware
-from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from winey.cache import LRUCache
 from winey.db.models import User
 from winey.db import OrmSession
+from winey.db.dialects import dialect_insert
+from winey.metrics import handler_duration, handlers_in_progress, throttled_updates
+from winey.throttling import RateLimiter
 
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Measures duration of message handlers labeled by handler function name
+    """
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        handler = current_handler.get()
+        name = handler.__name__ if handler is not None else 'unknown'
+        handlers_in_progress.inc(handler=name)
+        data['_metrics_handler'] = (name, time.perf_counter())
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        if '_metrics_handler' in data:
+            name, start = data.pop('_metrics_handler')
+            handlers_in_progress.dec(handler=name)
+            handler_duration.observe(time.perf_counter() - start, handler=name)
+
+
 class PrivateChatOnlyMiddleware(BaseMiddleware):
 
     async def on_pre_process_message(self, message: types.Message, data: dict):
@@ -21,28 +44,82 @@ class PrivateChatOnlyMiddleware(BaseMiddleware):
             raise CancelHandler()
 
 
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Drops messages of a user sending faster than `user_rate` per second after a burst of `user_burst`,
+    and messages of everyone once all users together exceed `global_rate`, so floods don't reach
+    the database and S3. The user is told about it once per `warning_interval` seconds
+    """
+
+    def __init__(self, user_rate=1, user_burst=10, global_rate=100, global_burst=200, warning_interval=60):
+        super().__init__()
+        self.users = RateLimiter(user_rate, user_burst)
+        self.everyone = RateLimiter(global_rate, global_burst, max_size=1)
+        self._warned = LRUCache(10000, ttl=warning_interval)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        user_id = message.from_user.id
+        if not self.users.acquire(user_id):
+            scope = 'user'
+        elif not self.everyone.acquire(None):
+            # the message is dropped anyway, it mustn't count against the user's own limit
+            self.users.release(user_id)
+            scope = 'global'
+        else:
+            return
+        throttled_updates.inc(scope=scope)
+        if self._warned.get(user_id) is None:
+            self._warned.put(user_id, True)
+            if scope == 'user':
+                await message.reply('Не так быстро, пожалуйста, я за вами не успеваю. '
+                                    'Подождите немного и повторите последнее сообщение')
+            else:
+                await message.reply('Сейчас мне пишет очень много людей. '
+                                    'Повторите, пожалуйста, последнее сообщение через минуту')
+        raise CancelHandler()
+
+
 class GetOrCreateUserMiddleware(LifetimeControllerMiddleware):
+    """
+    Provides handlers with `user` and `is_new_user` arguments.
+    Users are cached, so handling messages of known users doesn't touch the database,
+    hit and miss counters are available as `users.hits` and `users.misses`
+    """
     skip_patterns = ['error', 'update', 'channel_post', 'poll']
 
+    def __init__(self, cache_size=1024, cache_ttl=600):
+        super().__init__()
+        self.users = LRUCache(cache_size, ttl=cache_ttl)
+
     async def pre_process(self, obj, data, *args):
         from_user = types.User.get_current()
+        user = self.users.get(from_user.id)
+        data['is_new_user'] = False
+        if user is None:
+            user, data['is_new_user'] = await self.get_or_create_user(from_user, obj.date)
+            self.users.put(from_user.id, user)
+        data['user'] = user
+
+    @staticmethod
+    async def get_or_create_user(from_user: types.User, dt):
+        """
+        Inserts the user unless it already exists, only existing users take a second query to be loaded
+        """
         async with OrmSession() as session:
-            # TODO take care about caching
-            user = await session.get(User, from_user.id)
-            data['user'] = user
-            data['is_new_user'] = False
-            if not data['user']:
-                dt = obj.date
-                log.info(f'Creating user @{from_user.username} with id {from_user.id}')
-                user = User(
+            insert_stmt = dialect_insert(session, User) \
+                .values(
                     id=from_user.id,
                     username=from_user.username,
                     first_name=from_user.first_name,
                     last_name=from_user.last_name,
                     lang=from_user.language_code,
                     joined_dt=dt
-                )
-                session.add(user)
+                ) \
+                .on_conflict_do_nothing(index_elements=[User.id]) \
+                .returning(*User.__table__.columns)
+            inserted = (await session.execute(insert_stmt)).one_or_none()
+            if inserted is not None:
                 await session.commit()
-                data['user'] = user
-                data['is_new_user'] = True
+                log.info(f'Created user @{from_user.username} with id {from_user.id}')
+                return User(**inserted._mapping), True
+            return await session.get(User, from_user.id), False
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from aiogram import Bot
+from sqlalchemy import update
+from sqlalchemy.future import select
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob, PhotoUpload, WinePhoto
+from winey.db.versions import bump_data_version
+from winey.s3 import S3Client
+from .photos import save_photo_blob, store_telegram_photo
+
+
+log = logging.getLogger(__name__)
+
+
+class PhotoUploadWorkerPool:
+    """
+    Drains the photo_uploads outbox in the background.
+
+    Due uploads are claimed in batches by leasing them for `lease_timeout` seconds
+    (rows locked by other bot processes are skipped on PostgreSQL), then transferred by `workers`
+    concurrent workers. Failed uploads are retried with exponential backoff until `max_attempts`
+    is reached, after which they are marked as failed
+    """
+
+    def __init__(self, bot: Bot, s3client: S3Client, process_pool: ProcessPoolExecutor, workers=4, batch_size=16,
+                 poll_interval=5, lease_timeout=300, max_attempts=8, retry_delay=5):
+        self.bot = bot
+        self.s3client = s3client
+        self.process_pool = process_pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_timeout = timedelta(seconds=lease_timeout)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue = asyncio.Queue(maxsize=batch_size)
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def wake_up(self):
+        """
+        Makes pool look for new uploads right away instead of waiting for the next poll
+        """
+        self._wakeup.set()
+
+    async def start(self, _=None):
+        self._tasks.append(asyncio.create_task(self._claim_uploads()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def stop(self, _=None):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _claim_batch(self):
+        now = datetime.now(timezone.utc)
+        async with OrmSession() as session:
+            select_stmt = select(PhotoUpload) \
+                .where(PhotoUpload.status == PhotoUpload.PENDING, PhotoUpload.next_attempt_dt <= now) \
+                .order_by(PhotoUpload.next_attempt_dt) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True)
+            uploads = (await session.execute(select_stmt)).scalars().all()
+            for upload in uploads:
+                upload.attempts += 1
+                upload.next_attempt_dt = now + self.lease_timeout
+            await session.commit()
+        return uploads
+
+    async def _claim_uploads(self):
+        while True:
+            try:
+                uploads = await self._claim_batch()
+            except Exception:
+                log.exception('Could not claim photo uploads')
+                uploads = []
+            for upload in uploads:
+                await self._queue.put(upload)
+            if len(uploads) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _work(self):
+        while True:
+            upload = await self._queue.get()
+            try:
+                try:
+                    blob = await store_telegram_photo(
+                        self.bot, self.s3client, self.process_pool,
+                        upload.telegram_file_id, upload.telegram_file_unique_id,
+                    )
+                except Exception as e:
+                    log.exception(f'Upload of photo {upload.photo_id} failed, attempt {upload.attempts}')
+                    await self._fail(upload, e)
+                else:
+                    await self._complete(upload, blob)
+            except Exception:
+                # the lease will expire and the upload will be claimed again
+                log.exception(f'Could not save state of photo {upload.photo_id} upload')
+
+    async def _complete(self, upload: PhotoUpload, blob: PhotoBlob):
+        async with OrmSession() as session:
+            await session.execute(
+                update(PhotoUpload).where(PhotoUpload.id == upload.id).values(status=PhotoUpload.DONE)
+            )
+            await save_photo_blob(session, blob)
+            await session.execute(
+                update(WinePhoto)
+                .where(WinePhoto.id == upload.photo_id)
+                .values(is_uploaded=True, object_key=blob.object_key, variants=blob.variants)
+            )
+            await bump_data_version(session)
+            await session.commit()
+
+    async def _fail(self, upload: PhotoUpload, error):
+        if upload.attempts >= self.max_attempts:
+            log.error(f'Giving up on uploading photo {upload.photo_id}')
+            values = {'status': PhotoUpload.FAILED}
+        else:
+            delay = self.retry_delay * 2 ** (upload.attempts - 1)
+            values = {'next_attempt_dt': datetime.now(timezone.utc) + timedelta(seconds=delay)}
+        async with OrmSession() as session:
+            await session.execute(
+                update(PhotoUpload).where(PhotoUpload.id == upload.id).values(last_error=repr(error), **values)
+            )
+            await session.commit()
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from aiogram import Bot
+from sqlalchemy.future import select
+from winey.db import OrmSession
+from winey.db.dialects import dialect_insert
+from winey.db.models import PhotoBlob
+from winey.images import upload_variants
+from winey.metrics import telegram_download_duration
+from winey.s3 import S3Client
+
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# downloads bigger than that are spooled to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+async def iter_telegram_file(bot: Bot, file_path):
+    session = await bot.get_session()
+    with telegram_download_duration.time():
+        async with session.get(bot.get_file_url(file_path), raise_for_status=True) as response:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+
+
+async def find_photo_blob(file_unique_id=None, content_hash=None):
+    async with OrmSession() as session:
+        if file_unique_id is not None:
+            return await session.get(PhotoBlob, file_unique_id)
+        select_stmt = select(PhotoBlob).where(PhotoBlob.content_hash == content_hash).limit(1)
+        return (await session.execute(select_stmt)).scalar_one_or_none()
+
+
+async def store_telegram_photo(bot: Bot, s3client: S3Client, process_pool: ProcessPoolExecutor,
+                               file_id, file_unique_id=None):
+    """
+    Makes sure the photo is stored in S3 under the hash of its content along with downscaled variants.
+    Files already known by `file_unique_id` are not downloaded, content already stored is not uploaded.
+
+    Returns PhotoBlob describing the stored photo, it's up to the caller to save it
+    """
+    if file_unique_id is not None:
+        blob = await find_photo_blob(file_unique_id=file_unique_id)
+        if blob is not None:
+            log.info(f'File {file_unique_id} is already stored with key {blob.object_key}')
+            return blob
+
+    file = await bot.get_file(file_id)
+    # the download is hashed as it goes and spooled, so memory use doesn't grow with the size of the photo
+    content_hash = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE) as spool:
+        async for chunk in iter_telegram_file(bot, file.file_path):
+            content_hash.update(chunk)
+            spool.write(chunk)
+        size = spool.tell()
+        blob = PhotoBlob(
+            telegram_file_unique_id=file.file_unique_id,
+            content_hash=content_hash.hexdigest(),
+            object_key=content_hash.hexdigest(),
+            created_dt=datetime.now(timezone.utc),
+        )
+
+        stored = await find_photo_blob(content_hash=blob.content_hash)
+        if stored is not None:
+            log.info(f'Content of file {file.file_unique_id} is already stored with key {stored.object_key}')
+            blob.object_key, blob.variants = stored.object_key, stored.variants
+            return blob
+
+        log.info(f'Uploading file {file.file_unique_id} ({size} bytes) to s3 with key {blob.object_key}')
+        await s3client.upload_file(blob.object_key, spool, size, content_type='image/jpeg')
+        # rendering decodes the whole image in the process pool anyway, the file is only read to be sent there
+        spool.seek(0)
+        blob.variants = await upload_variants(s3client, process_pool, blob.object_key, spool.read())
+    return blob
+
+
+async def save_photo_blob(session, blob: PhotoBlob):
+    """
+    Saves the blob unless the file is already known, returns whether it was saved
+    """
+    result = await session.execute(
+        dialect_insert(session, PhotoBlob)
+        .values(
+            telegram_file_unique_id=blob.telegram_file_unique_id,
+            content_hash=blob.content_hash,
+            object_key=blob.object_key,
+            variants=blob.variants,
+            created_dt=blob.created_dt,
+        )
+        .on_conflict_do_nothing(index_elements=[PhotoBlob.telegram_file_unique_id])
+    )
+    return result.rowcount == 1
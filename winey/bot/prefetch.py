@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from aiogram import Bot
+from sqlalchemy import delete, exists
+from sqlalchemy.future import select
+from winey.db import OrmSession
+from winey.db.models import PhotoBlob, PhotoUpload, WinePhoto
+from winey.images import variant_key
+from winey.s3 import S3Client
+from .photos import save_photo_blob, store_telegram_photo
+
+
+log = logging.getLogger(__name__)
+
+
+class PhotoPrefetcher:
+    """
+    Stores label photos while the user is still filling in the rest of the record, so by the end
+    of the conversation the photos are usually in S3 and the record can be saved as uploaded right away.
+
+    Prefetches are kept per conversation, so all photos of an album are transferred concurrently,
+    but no more than `concurrency` at once. At most `max_tasks` prefetches are kept, the ones nobody claimed
+    for `ttl` seconds are forgotten. Prefetches taking longer than `timeout` seconds are cancelled.
+    Claims wait for prefetches up to `wait_timeout` seconds and tell when the ones still running
+    will be over, uploads of these files are to be retried no earlier than that: by then the file
+    is either stored, so the upload outbox finds it by its unique id, or it's up to the outbox to transfer it.
+
+    Photos of discarded conversations aren't deleted right away, as stored files are shared by everyone
+    sending the same photo. Every `sweep_interval` seconds photos stored more than `ttl` seconds ago
+    which nothing refers to are deleted instead
+    """
+
+    def __init__(self, bot: Bot, s3client: S3Client, process_pool: ProcessPoolExecutor, max_tasks=64,
+                 concurrency=4, wait_timeout=1, timeout=60, ttl=3600, sweep_interval=3600):
+        self.bot = bot
+        self.s3client = s3client
+        self.process_pool = process_pool
+        self.max_tasks = max_tasks
+        self.wait_timeout = wait_timeout
+        self.timeout = timeout
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # conversation key -> {file unique id -> (task, start time)}
+        self._tasks = {}
+        # discarded prefetches and sweeps which are still running
+        self._background = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._last_sweep = time.monotonic()
+
+    def start(self, key, file_id, file_unique_id):
+        """
+        Starts storing a photo of the conversation
+        """
+        self._forget_stale()
+        self._sweep_later()
+        if file_unique_id in self._tasks.get(key, {}):
+            return
+        if sum(len(tasks) for tasks in self._tasks.values()) >= self.max_tasks:
+            log.warning(f'Too many photo prefetches, file {file_unique_id} is left to the upload outbox')
+            return
+        task = asyncio.create_task(self._prefetch(file_id, file_unique_id))
+        self._tasks.setdefault(key, {})[file_unique_id] = (task, time.monotonic())
+
+    async def claim(self, key, file_unique_ids):
+        """
+        Waits up to `wait_timeout` for the conversation's prefetches of the files.
+        Returns the stored PhotoBlobs by file unique id and deadlines of prefetches still running,
+        files which weren't prefetched or failed are in neither of them.
+        The conversation's other prefetches are discarded
+        """
+        tasks = self._tasks.pop(key, {})
+        self._keep_running(task for file_unique_id, (task, _) in tasks.items() if file_unique_id not in file_unique_ids)
+        tasks = {file_unique_id: tasks[file_unique_id] for file_unique_id in file_unique_ids if file_unique_id in tasks}
+        if not tasks:
+            return {}, {}
+        await asyncio.wait([task for task, _ in tasks.values()], timeout=self.wait_timeout)
+        blobs, deadlines = {}, {}
+        for file_unique_id, (task, started) in tasks.items():
+            if not task.done():
+                log.info(f'Prefetch of file {file_unique_id} is still running')
+                # slow prefetches go on in the background, they are over by the deadline either way
+                self._keep_running([task])
+                deadlines[file_unique_id] = datetime.now(timezone.utc) + timedelta(
+                    seconds=started + self.timeout - time.monotonic()
+                )
+            elif task.result() is not None:
+                blobs[file_unique_id] = task.result()[0]
+        return blobs, deadlines
+
+    def discard(self, key):
+        """
+        Drops the conversation's prefetches, photos stored by them are left to the sweep
+        """
+        self._keep_running(task for task, _ in self._tasks.pop(key, {}).values())
+
+    async def stop(self, _=None):
+        tasks = [task for tasks in self._tasks.values() for task, _ in tasks.values()] + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _forget_stale(self):
+        now = time.monotonic()
+        for key, tasks in list(self._tasks.items()):
+            if all(task.done() and now - started > self.ttl for task, started in tasks.values()):
+                del self._tasks[key]
+
+    def _keep_running(self, tasks):
+        for task in tasks:
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def _sweep_later(self):
+        if time.monotonic() - self._last_sweep > self.sweep_interval:
+            self._last_sweep = time.monotonic()
+            self._keep_running([asyncio.create_task(self.sweep())])
+
+    async def _prefetch(self, file_id, file_unique_id):
+        """
+        Returns the stored PhotoBlob and whether it's saved by this prefetch, None if prefetch failed
+        """
+        try:
+            return await asyncio.wait_for(self._store(file_id, file_unique_id), self.timeout)
+        except asyncio.TimeoutError:
+            log.warning(f'Prefetch of file {file_unique_id} timed out')
+        except Exception:
+            log.exception(f'Prefetch of file {file_unique_id} failed')
+        return None
+
+    async def _store(self, file_id, file_unique_id):
+        async with self._semaphore:
+            blob = await store_telegram_photo(self.bot, self.s3client, self.process_pool, file_id, file_unique_id)
+        async with OrmSession() as session:
+            is_new = await save_photo_blob(session, blob)
+            await session.commit()
+        return blob, is_new
+
+    def _live_blobs(self):
+        """
+        Returns unique ids and object keys of files being prefetched or kept for a conversation
+        """
+        file_unique_ids, object_keys = set(), set()
+        for tasks in self._tasks.values():
+            for file_unique_id, (task, _) in tasks.items():
+                file_unique_ids.add(file_unique_id)
+                if task.done() and not task.cancelled() and task.result() is not None:
+                    object_keys.add(task.result()[0].object_key)
+        return file_unique_ids, object_keys
+
+    async def sweep(self):
+        """
+        Deletes photos stored more than `ttl` seconds ago which no record, pending upload or prefetch refers to
+        """
+        unreferenced = (
+            PhotoBlob.created_dt < datetime.now(timezone.utc) - timedelta(seconds=self.ttl),
+            ~exists().where(WinePhoto.object_key == PhotoBlob.object_key),
+            ~exists().where(
+                PhotoUpload.telegram_file_unique_id == PhotoBlob.telegram_file_unique_id,
+                PhotoUpload.status == PhotoUpload.PENDING,
+            ),
+        )
+        try:
+            async with OrmSession() as session:
+                live_file_unique_ids, live_object_keys = self._live_blobs()
+                blobs = [
+                    blob for blob in (await session.execute(select(PhotoBlob).where(*unreferenced))).scalars()
+                    if blob.telegram_file_unique_id not in live_file_unique_ids
+                    and blob.object_key not in live_object_keys
+                ]
+                if not blobs:
+                    return
+                # conditions are checked again, the photo could have been saved with a record meanwhile
+                await session.execute(delete(PhotoBlob).where(
+                    PhotoBlob.telegram_file_unique_id.in_([blob.telegram_file_unique_id for blob in blobs]),
+                    *unreferenced
+                ).execution_options(synchronize_session=False))
+                variants = {blob.object_key: blob.variants or {} for blob in blobs}
+                referenced = set((await session.execute(
+                    select(PhotoBlob.object_key).where(PhotoBlob.object_key.in_(list(variants)))
+                    .union(select(WinePhoto.object_key).where(WinePhoto.object_key.in_(list(variants))))
+                )).scalars())
+                await session.commit()
+            for object_key, widths in variants.items():
+                if object_key in referenced:
+                    continue
+                log.info(f'Deleting unreferenced photo {object_key}')
+                for name in widths:
+                    await self.s3client.delete_object(variant_key(name, object_key))
+        except Exception:
+            log.exception('Could not delete unreferenced photos')
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import logging
+from collections import deque
+from aiogram import Dispatcher, types
+
+
+log = logging.getLogger(__name__)
+
+
+def sender_id(update: types.Update):
+    """
+    Returns id of the user who caused the update or None if there is no such user
+    """
+    for event in (update.message, update.edited_message, update.callback_query, update.inline_query,
+                  update.chosen_inline_result, update.shipping_query, update.pre_checkout_query,
+                  update.my_chat_member, update.chat_member, update.chat_join_request):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return None
+
+
+class UpdateSequencer:
+    """
+    Runs jobs with different keys concurrently while jobs sharing a key are run strictly one by one
+    in submission order.
+
+    At most `max_in_flight` jobs run at the same time. Once `max_pending` jobs are queued
+    callers of `run` wait for a free slot, and sources of updates which don't wait for their handling
+    (i.e. long polling) can hold off with `wait_for_room`, so updates don't pile up in memory
+    """
+
+    def __init__(self, max_in_flight=32, max_pending=1024):
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._queues = {}
+        self._draining = set()
+        self.pending_count = 0
+        self.in_flight_count = 0
+
+    async def run(self, key, job):
+        """
+        Schedules `job` coroutine function and waits for its result
+        """
+        await self._pending.acquire()
+        self.pending_count += 1
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            draining = asyncio.create_task(self._drain(key, queue))
+            self._draining.add(draining)
+            draining.add_done_callback(self._draining.discard)
+            draining.add_done_callback(functools.partial(self._drained, key, queue))
+        queue.append((job, future))
+        return await future
+
+    async def wait_for_room(self):
+        """
+        Waits until fewer than `max_pending` jobs are queued
+        """
+        async with self._pending:
+            pass
+
+    async def _drain(self, key, queue):
+        try:
+            while queue:
+                job, future = queue[0]
+                async with self._in_flight:
+                    self.in_flight_count += 1
+                    try:
+                        result = await job()
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        self.in_flight_count -= 1
+                queue.popleft()
+                self.pending_count -= 1
+                self._pending.release()
+        finally:
+            del self._queues[key]
+
+    def _drained(self, key, queue, _):
+        # the drain was cancelled (e.g. on shutdown), possibly before it even started,
+        # jobs it hasn't run mustn't keep their callers waiting
+        if self._queues.get(key) is queue:
+            del self._queues[key]
+        while queue:
+            _, future = queue.popleft()
+            future.cancel()
+            self.pending_count -= 1
+            self._pending.release()
+
+
+class SequencedDispatcher(Dispatcher):
+    """
+    Dispatcher processing updates of different users concurrently, but updates of one user in order,
+    so conversation steps never overtake each other.
+
+    aiogram's polling hands every batch over to a task of its own and asks for the next one right away,
+    so while polling getUpdates is held back until the previous batch is queued and the sequencer
+    has room for more updates.
+    Telegram keeps the rest meanwhile
+    """
+
+    def __init__(self, *args, sequencer: UpdateSequencer, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sequencer = sequencer
+        # ids of polled updates which haven't reached the sequencer yet
+        self._unqueued = set()
+        self._all_queued = asyncio.Event()
+        self._all_queued.set()
+
+    async def process_update(self, update: types.Update):
+        key = sender_id(update)
+        if key is None:
+            key = ('update', update.update_id)
+        self._mark_queued([update])
+        return await self.sequencer.run(key, functools.partial(super().process_update, update))
+
+    async def process_updates(self, updates, fast: bool = True):
+        try:
+            return await super().process_updates(updates, fast)
+        finally:
+            # updates cancelled by middlewares never reach process_update
+            self._mark_queued(updates)
+
+    def _mark_queued(self, updates):
+        if self._unqueued:
+            self._unqueued.difference_update(update.update_id for update in updates)
+            if not self._unqueued:
+                self._all_queued.set()
+
+    async def start_polling(self, *args, **kwargs):
+        get_updates = self.bot.get_updates
+
+        async def get_updates_when_ready(*get_updates_args, **get_updates_kwargs):
+            await self._all_queued.wait()
+            await self.sequencer.wait_for_room()
+            updates = await get_updates(*get_updates_args, **get_updates_kwargs)
+            if updates:
+                self._unqueued.update(update.update_id for update in updates)
+                self._all_queued.clear()
+            return updates
+
+        self.bot.get_updates = get_updates_when_ready
+        try:
+            return await super().start_polling(*args, **kwargs)
+        finally:
+            del self.bot.get_updates
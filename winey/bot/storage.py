@@ -0,0 +1,162 @@
+import asyncio
+import copy
+import logging
+import time
+import typing
+from datetime import datetime, timedelta, timezone
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import delete
+from winey.db.dialects import dialect_insert
+from winey.db.models import FsmState
+
+
+log = logging.getLogger(__name__)
+
+Address = typing.Tuple[int, int]
+
+
+def _empty_record():
+    return {'state': None, 'data': {}, 'bucket': {}}
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM storage keeping every conversation in its own fsm_states row, so it survives restarts.
+
+    Changes made within `flush_delay` seconds (e.g. state and data updates of the same step)
+    are coalesced into a single upsert per conversation. Until then they are only seen by this process,
+    so the storage is meant for a single bot process, other processes would read stale conversations
+    and overwrite each other's changes. Conversations untouched for `ttl` seconds
+    are considered abandoned: they are not loaded anymore and are deleted every `cleanup_interval` seconds
+    """
+
+    def __init__(self, session_factory, flush_delay=0.1, ttl=7 * 24 * 3600, cleanup_interval=3600):
+        self.session_factory = session_factory
+        self.flush_delay = flush_delay
+        self.ttl = timedelta(seconds=ttl)
+        self.cleanup_interval = cleanup_interval
+        self._dirty: typing.Dict[Address, dict] = {}
+        self._flushing: typing.Dict[Address, dict] = {}
+        self._flush_task = None
+        # only one flush at a time, so records being written stay visible to readers until they are committed
+        self._flush_lock = asyncio.Lock()
+        self._last_cleanup = time.monotonic()
+
+    @staticmethod
+    def _address(chat, user) -> Address:
+        chat, user = BaseStorage.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _load(self, address: Address):
+        record = self._dirty.get(address) or self._flushing.get(address)
+        if record is not None:
+            return record
+        async with self.session_factory() as session:
+            row = await session.get(FsmState, address)
+        if row is None or row.updated_dt.replace(tzinfo=timezone.utc) < datetime.now(timezone.utc) - self.ttl:
+            return _empty_record()
+        return {'state': row.state, 'data': row.data, 'bucket': row.bucket}
+
+    async def _save(self, address: Address, **changes):
+        record = {**await self._load(address), **changes}
+        self._dirty[address] = record
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            # cancelling the task (on close) mustn't interrupt a commit, the conversations being written would be lost
+            await asyncio.shield(self.flush())
+            # changes made during the flush (or not saved because of an error) go with the next one
+            if not self._dirty:
+                break
+        self._flush_task = None
+
+    async def flush(self):
+        """
+        Writes coalesced changes to the database
+        """
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        self._flushing.update(self._dirty)
+        self._dirty = {}
+        now = datetime.now(timezone.utc)
+        try:
+            async with self.session_factory() as session:
+                for (chat_id, user_id), record in self._flushing.items():
+                    if record == _empty_record():
+                        await session.execute(
+                            delete(FsmState).where(FsmState.chat_id == chat_id, FsmState.user_id == user_id)
+                        )
+                        continue
+                    values = {**record, 'updated_dt': now}
+                    await session.execute(
+                        dialect_insert(session, FsmState)
+                        .values(chat_id=chat_id, user_id=user_id, **values)
+                        .on_conflict_do_update(index_elements=[FsmState.chat_id, FsmState.user_id], set_=values)
+                    )
+                if time.monotonic() - self._last_cleanup > self.cleanup_interval:
+                    self._last_cleanup = time.monotonic()
+                    await session.execute(delete(FsmState).where(FsmState.updated_dt < now - self.ttl))
+                await session.commit()
+        except Exception:
+            log.exception(f'Could not save {len(self._flushing)} conversations, will retry')
+            for address, record in self._flushing.items():
+                self._dirty.setdefault(address, record)
+        finally:
+            self._flushing = {}
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # waits for the flush in progress, if any
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = await self._load(self._address(chat, user))
+        return record['state'] or self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = await self._load(self._address(chat, user))
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        await self._save(self._address(chat, user), state=self.resolve_state(state))
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        await self._save(self._address(chat, user), data=copy.deepcopy(data or {}))
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        address = self._address(chat, user)
+        record = await self._load(address)
+        await self._save(address, data={**record['data'], **copy.deepcopy(data or {}), **kwargs})
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        changes = {'state': None}
+        if with_data:
+            changes['data'] = {}
+        await self._save(self._address(chat, user), **changes)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        record = await self._load(self._address(chat, user))
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        await self._save(self._address(chat, user), bucket=copy.deepcopy(bucket or {}))
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        address = self._address(chat, user)
+        record = await self._load(address)
+        await self._save(address, bucket={**record['bucket'], **copy.deepcopy(bucket or {}), **kwargs})
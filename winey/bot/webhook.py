@@ -0,0 +1,20 @@
+import hmac
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+
+
+SECRET_TOKEN_KEY = 'WINEY_BOT_WEBHOOK_SECRET_TOKEN'
+
+
+class SecretTokenRequestHandler(WebhookRequestHandler):
+    """
+    Rejects updates which don't carry the secret token the webhook was registered with
+    """
+
+    async def post(self):
+        secret_token = self.request.app.get(SECRET_TOKEN_KEY)
+        if secret_token:
+            received_token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received_token, secret_token):
+                raise web.HTTPForbidden()
+        return await super().post()
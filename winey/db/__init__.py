@@ -1,8 +1,43 @@
 import os
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from winey.metrics import instrument_engine
 
 
-DATABASE_URI = os.environ['WINEY_DATABASE_URI']
-orm_engine = create_async_engine(DATABASE_URI, echo=True)
-OrmSession = sessionmaker(orm_engine, expire_on_commit=False, class_=AsyncSession)
+# bound to the engine by init_orm, so modules using it can be imported before the configuration is known
+OrmSession = sessionmaker(expire_on_commit=False, class_=AsyncSession)
+_engine = None
+
+
+def init_orm(database_uri=None, **engine_kwargs):
+    """
+    Creates the engine (for WINEY_DATABASE_URI by default) and binds OrmSession to it
+    """
+    global _engine
+    _engine = create_async_engine(
+        database_uri or os.environ['WINEY_DATABASE_URI'],
+        echo=os.environ.get('WINEY_DATABASE_ECHO', '').lower() in ('1', 'true', 'yes'),
+        **engine_kwargs
+    )
+    instrument_engine(_engine)
+    if _engine.dialect.name == 'sqlite':
+        event.listen(_engine.sync_engine, 'connect', _register_sqlite_functions)
+    OrmSession.configure(bind=_engine)
+    return _engine
+
+
+def _register_sqlite_functions(dbapi_connection, _):
+    """
+    SQLite's own lower() only folds ASCII letters, so searching cyrillic text uses Python's instead
+    """
+    dbapi_connection.create_function(
+        'unicode_lower', 1, lambda value: value.lower() if value is not None else None, deterministic=True
+    )
+
+
+async def close_orm():
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
@@ -0,0 +1,35 @@
+"""FSM states
+
+Revision ID: 491d3202889a
+Revises: 4acfedbbff3e
+Create Date: 2021-07-24 16:48:31.117604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '491d3202889a'
+down_revision = '4acfedbbff3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'fsm_states',
+        sa.Column('chat_id', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('state', sa.String(length=256), nullable=True),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('bucket', sa.JSON(), nullable=False),
+        sa.Column('updated_dt', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('chat_id', 'user_id')
+    )
+    op.create_index('ix_fsm_states_updated_dt', 'fsm_states', ['updated_dt'])
+
+
+def downgrade():
+    op.drop_index('ix_fsm_states_updated_dt', table_name='fsm_states')
+    op.drop_table('fsm_states')
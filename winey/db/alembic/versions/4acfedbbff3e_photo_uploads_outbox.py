@@ -0,0 +1,43 @@
+"""Photo uploads outbox
+
+Revision ID: 4acfedbbff3e
+Revises: b7f05c1ce2ea
+Create Date: 2021-07-17 11:26:09.830412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4acfedbbff3e'
+down_revision = 'b7f05c1ce2ea'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'wine_photos',
+        sa.Column('is_uploaded', sa.Boolean(), server_default=sa.true(), nullable=False)
+    )
+    op.create_table(
+        'photo_uploads',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('photo_id', sa.String(length=128), nullable=False),
+        sa.Column('telegram_file_id', sa.String(length=256), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_dt', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_dt', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['photo_id'], ['wine_photos.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_photo_uploads_status_next_attempt_dt', 'photo_uploads', ['status', 'next_attempt_dt'])
+
+
+def downgrade():
+    op.drop_index('ix_photo_uploads_status_next_attempt_dt', table_name='photo_uploads')
+    op.drop_table('photo_uploads')
+    op.drop_column('wine_photos', 'is_uploaded')
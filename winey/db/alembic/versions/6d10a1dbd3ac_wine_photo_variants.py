@@ -0,0 +1,24 @@
+"""Wine photo variants
+
+Revision ID: 6d10a1dbd3ac
+Revises: 491d3202889a
+Create Date: 2021-07-31 13:05:52.764218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d10a1dbd3ac'
+down_revision = '491d3202889a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('wine_photos', sa.Column('variants', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('wine_photos', 'variants')
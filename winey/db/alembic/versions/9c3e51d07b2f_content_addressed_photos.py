@@ -0,0 +1,40 @@
+"""Content addressed photos
+
+Revision ID: 9c3e51d07b2f
+Revises: f70be5e3608d
+Create Date: 2021-08-14 12:41:27.310985
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e51d07b2f'
+down_revision = 'f70be5e3608d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('wine_photos', sa.Column('object_key', sa.String(length=128), nullable=True))
+    # photos stored before were keyed by their id
+    op.execute('UPDATE wine_photos SET object_key = id')
+    op.add_column('photo_uploads', sa.Column('telegram_file_unique_id', sa.String(length=128), nullable=True))
+    op.create_table(
+        'photo_blobs',
+        sa.Column('telegram_file_unique_id', sa.String(length=128), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('object_key', sa.String(length=128), nullable=False),
+        sa.Column('variants', sa.JSON(), nullable=True),
+        sa.Column('created_dt', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('telegram_file_unique_id')
+    )
+    op.create_index('ix_photo_blobs_content_hash', 'photo_blobs', ['content_hash'])
+
+
+def downgrade():
+    op.drop_index('ix_photo_blobs_content_hash', table_name='photo_blobs')
+    op.drop_table('photo_blobs')
+    op.drop_column('photo_uploads', 'telegram_file_unique_id')
+    op.drop_column('wine_photos', 'object_key')
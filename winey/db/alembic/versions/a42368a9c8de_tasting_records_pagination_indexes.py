@@ -0,0 +1,32 @@
+"""Tasting records pagination indexes
+
+Revision ID: a42368a9c8de
+Revises: a23209127576
+Create Date: 2021-07-03 12:41:18.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a42368a9c8de'
+down_revision = 'a23209127576'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_tasting_records_dt_id',
+        'tasting_records',
+        [sa.text('dt DESC'), sa.text('id DESC')],
+    )
+    op.create_index('ix_tasting_records_user_id_dt', 'tasting_records', ['user_id', 'dt'])
+    op.create_index('ix_wine_photos_tasting_record_id', 'wine_photos', ['tasting_record_id'])
+
+
+def downgrade():
+    op.drop_index('ix_wine_photos_tasting_record_id', table_name='wine_photos')
+    op.drop_index('ix_tasting_records_user_id_dt', table_name='tasting_records')
+    op.drop_index('ix_tasting_records_dt_id', table_name='tasting_records')
@@ -0,0 +1,33 @@
+"""Data versions
+
+Revision ID: b7f05c1ce2ea
+Revises: a42368a9c8de
+Create Date: 2021-07-10 18:02:47.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f05c1ce2ea'
+down_revision = 'a42368a9c8de'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    data_versions = op.create_table(
+        'data_versions',
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_dt', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.execute(
+        data_versions.insert().values(name='tasting_records', version=0, updated_dt=sa.func.now())
+    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
@@ -0,0 +1,24 @@
+"""Wine photo position
+
+Revision ID: c2d9e7a41f58
+Revises: e5b8a2f4c613
+Create Date: 2021-08-28 12:41:09.517302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d9e7a41f58'
+down_revision = 'e5b8a2f4c613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('wine_photos', sa.Column('position', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('wine_photos', 'position')
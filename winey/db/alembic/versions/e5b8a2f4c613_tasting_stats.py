@@ -0,0 +1,36 @@
+"""Tasting stats
+
+Revision ID: e5b8a2f4c613
+Revises: 9c3e51d07b2f
+Create Date: 2021-08-21 17:03:44.128530
+
+The table starts empty, fill it with `python -m winey.stats` after upgrading
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8a2f4c613'
+down_revision = '9c3e51d07b2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tasting_stats',
+        sa.Column('user_id', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('dimension', sa.String(length=16), nullable=False),
+        sa.Column('value', sa.String(length=256), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'dimension', 'value')
+    )
+    op.create_index(
+        'ix_tasting_stats_user_id_dimension_count', 'tasting_stats', ['user_id', 'dimension', 'count']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_tasting_stats_user_id_dimension_count', table_name='tasting_stats')
+    op.drop_table('tasting_stats')
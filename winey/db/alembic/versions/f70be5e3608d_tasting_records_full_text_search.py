@@ -0,0 +1,41 @@
+"""Tasting records full text search
+
+Revision ID: f70be5e3608d
+Revises: 6d10a1dbd3ac
+Create Date: 2021-08-07 10:22:36.905127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f70be5e3608d'
+down_revision = '6d10a1dbd3ac'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tsvector is PostgreSQL only, see winey.db.queries.search_condition for the fallback
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        ALTER TABLE tasting_records ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('russian', wine_name || ' ' || region || ' ' || grapes || ' ' || experience) ||
+            to_tsvector('simple', wine_name || ' ' || region || ' ' || grapes)
+        ) STORED
+    """)
+    op.create_index(
+        'ix_tasting_records_search_vector',
+        'tasting_records',
+        ['search_vector'],
+        postgresql_using='gin',
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_tasting_records_search_vector', table_name='tasting_records')
+    op.drop_column('tasting_records', 'search_vector')
@@ -0,0 +1,14 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def dialect_insert(session, table):
+    """
+    Returns dialect specific INSERT construct supporting ON CONFLICT clauses
+    """
+    return _INSERTS[session.bind.dialect.name](table)
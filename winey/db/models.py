@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, true
 
 
 Base = declarative_base()
@@ -26,10 +26,96 @@ class TastingRecord(Base):
     grapes = Column(String(256), nullable=False)
     vintage_year = Column(Integer)
     experience = Column(Text, nullable=False)
-    photos = relationship('WinePhoto')
+    photos = relationship('WinePhoto', order_by='WinePhoto.position')
+
+    __table_args__ = (
+        Index('ix_tasting_records_dt_id', dt.desc(), id.desc()),
+        Index('ix_tasting_records_user_id_dt', user_id, dt),
+    )
 
 
 class WinePhoto(Base):
     __tablename__ = 'wine_photos'
     id = Column(String(128), primary_key=True)
-    tasting_record_id = Column(Integer, ForeignKey('tasting_records.id'))
+    tasting_record_id = Column(Integer, ForeignKey('tasting_records.id'), index=True)
+    is_uploaded = Column(Boolean, nullable=False, server_default=true())
+    # order of the photo in the album it was sent with
+    position = Column(Integer, nullable=False, server_default='0')
+    # S3 key of the original, photos with the same content share it
+    object_key = Column(String(128))
+    # variant name -> width of downscaled copies stored next to the original, see winey.images
+    variants = Column(JSON(none_as_null=True))
+
+
+class PhotoUpload(Base):
+    """
+    Outbox of photos which are still to be transferred from Telegram to S3
+    """
+    __tablename__ = 'photo_uploads'
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True)
+    photo_id = Column(String(128), ForeignKey('wine_photos.id'), nullable=False)
+    telegram_file_id = Column(String(256), nullable=False)
+    telegram_file_unique_id = Column(String(128))
+    status = Column(String(16), nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_dt = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text)
+    created_dt = Column(DateTime(timezone=True), nullable=False)
+    photo = relationship('WinePhoto')
+
+    __table_args__ = (
+        Index('ix_photo_uploads_status_next_attempt_dt', status, next_attempt_dt),
+    )
+
+
+class PhotoBlob(Base):
+    """
+    Telegram files already stored in S3 under the hash of their content. Photos sent again are found
+    by file_unique_id and are not downloaded, new files with already stored content are not uploaded
+    """
+    __tablename__ = 'photo_blobs'
+    telegram_file_unique_id = Column(String(128), primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    object_key = Column(String(128), nullable=False)
+    variants = Column(JSON(none_as_null=True))
+    created_dt = Column(DateTime(timezone=True), nullable=False)
+
+
+class TastingStat(Base):
+    """
+    Number of tasting records per value of a dimension (region, grape, ...) of a user
+    and of all users together (user_id 0). Maintained incrementally as records are added, see winey.stats
+    """
+    __tablename__ = 'tasting_stats'
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    dimension = Column(String(16), primary_key=True)
+    value = Column(String(256), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_tasting_stats_user_id_dimension_count', user_id, dimension, count),
+    )
+
+
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_dt = Column(DateTime(timezone=True), nullable=False)
+
+
+class FsmState(Base):
+    """
+    State and data of a conversation with the bot
+    """
+    __tablename__ = 'fsm_states'
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    state = Column(String(256))
+    data = Column(JSON, nullable=False)
+    bucket = Column(JSON, nullable=False)
+    updated_dt = Column(DateTime(timezone=True), nullable=False, index=True)
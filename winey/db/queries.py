@@ -0,0 +1,126 @@
+from datetime import datetime
+from sqlalchemy import tuple_, or_, func, literal_column
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from .models import TastingRecord
+
+
+def encode_cursor(tasting_record: TastingRecord) -> str:
+    return f'{tasting_record.id}:{tasting_record.dt.isoformat()}'
+
+
+def decode_cursor(cursor: str):
+    """
+    Raises ValueError if cursor is malformed
+    """
+    record_id, dt = cursor.split(':', 1)
+    return datetime.fromisoformat(dt), int(record_id)
+
+
+def search_condition(dialect_name, query):
+    """
+    On PostgreSQL records are matched against the search_vector column, which is generated from
+    the record's text with both russian and simple configurations and is covered by a GIN index.
+
+    Other databases (i.e. SQLite used for development) have no tsvector, so as a fallback
+    the text columns are scanned with case insensitive LIKE, using unicode_lower() registered by init_orm
+    """
+    if dialect_name == 'postgresql':
+        ts_query = func.websearch_to_tsquery('russian', query).op('||')(func.websearch_to_tsquery('simple', query))
+        return literal_column('tasting_records.search_vector').op('@@')(ts_query)
+    return or_(*(
+        func.unicode_lower(column).contains(query.lower(), autoescape=True)
+        for column in (TastingRecord.wine_name, TastingRecord.region, TastingRecord.grapes, TastingRecord.experience)
+    ))
+
+
+def tasting_records_page_select(dialect_name, limit, before=None, query=None, user_id=None):
+    """
+    Selects newest first tasting records older than `before` cursor (keyset on dt and id), one more than `limit`
+    to tell whether there is a following page. Raises ValueError if cursor is malformed
+    """
+    select_stmt = select(TastingRecord) \
+        .options(
+        selectinload(TastingRecord.photos)
+    ).order_by(TastingRecord.dt.desc(), TastingRecord.id.desc()).limit(limit + 1)
+    if query:
+        select_stmt = select_stmt.where(search_condition(dialect_name, query))
+    if user_id is not None:
+        select_stmt = select_stmt.where(TastingRecord.user_id == user_id)
+    if before is not None:
+        before_dt, before_id = decode_cursor(before)
+        select_stmt = select_stmt.where(tuple_(TastingRecord.dt, TastingRecord.id) < tuple_(before_dt, before_id))
+    return select_stmt
+
+
+async def fetch_tasting_records_page(session, limit, before=None, query=None, user_id=None):
+    """
+    Returns newest first tasting records older than `before` cursor and the cursor of the following page,
+    which is None for the last one.
+    Records are optionally narrowed down to the ones matching search `query` or belonging to the user
+    """
+    select_stmt = tasting_records_page_select(session.bind.dialect.name, limit, before, query, user_id)
+    tasting_records_result = await session.execute(select_stmt)
+    tasting_records = tasting_records_result.scalars().all()
+    if len(tasting_records) > limit:
+        return tasting_records[:limit], encode_cursor(tasting_records[limit - 1])
+    return tasting_records, None
+
+
+class TastingRecordsPageStream:
+    """
+    The page of `fetch_tasting_records_page`, but records are yielded by `stream` while they are being fetched
+    with a server side cursor, `batch_size` at a time. `next_cursor` is known once the stream is exhausted
+    """
+
+    def __init__(self, limit, before=None, query=None, user_id=None, batch_size=50):
+        if before is not None:
+            decode_cursor(before)
+        self.limit = limit
+        self.before = before
+        self.query = query
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.next_cursor = None
+
+    async def stream(self, session):
+        select_stmt = tasting_records_page_select(
+            session.bind.dialect.name, self.limit, self.before, self.query, self.user_id
+        ).execution_options(yield_per=self.batch_size)
+        result = await session.stream(select_stmt)
+        try:
+            count, last_tasting_record = 0, None
+            async for tasting_records in result.scalars().partitions():
+                for tasting_record in tasting_records:
+                    if count == self.limit:
+                        self.next_cursor = encode_cursor(last_tasting_record)
+                        return
+                    yield tasting_record
+                    count, last_tasting_record = count + 1, tasting_record
+        finally:
+            await result.close()
+
+
+async def fetch_tasting_record(session, record_id):
+    """
+    Returns tasting record with its photos or None if there is no such record
+    """
+    return await session.get(TastingRecord, record_id, options=[selectinload(TastingRecord.photos)])
+
+
+async def stream_tasting_records(session, user_id=None, batch_size=500):
+    """
+    Yields tasting records with their photos oldest first, optionally only the user's ones.
+    Rows are fetched `batch_size` at a time with a server side cursor, so memory use doesn't grow
+    with the number of records
+    """
+    select_stmt = select(TastingRecord) \
+        .options(selectinload(TastingRecord.photos)) \
+        .order_by(TastingRecord.dt, TastingRecord.id) \
+        .execution_options(yield_per=batch_size)
+    if user_id is not None:
+        select_stmt = select_stmt.where(TastingRecord.user_id == user_id)
+    result = await session.stream(select_stmt)
+    async for tasting_records in result.scalars().partitions():
+        for tasting_record in tasting_records:
+            yield tasting_record
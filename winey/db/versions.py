@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.future import select
+from .dialects import dialect_insert
+from .models import DataVersion
+
+
+TASTING_RECORDS = 'tasting_records'
+NOTIFY_CHANNEL = 'winey_data_versions'
+
+
+async def bump_data_version(session, name=TASTING_RECORDS):
+    """
+    Increments the version in the session's transaction, so it becomes visible together with the changes.
+    On PostgreSQL listeners of NOTIFY_CHANNEL are also notified once the transaction is committed
+    """
+    now = datetime.now(timezone.utc)
+    # a single statement, so concurrent first bumps don't both try to insert the row
+    await session.execute(
+        dialect_insert(session, DataVersion)
+        .values(name=name, version=1, updated_dt=now)
+        .on_conflict_do_update(
+            index_elements=[DataVersion.name],
+            set_={'version': DataVersion.version + 1, 'updated_dt': now},
+        )
+    )
+    if session.bind.dialect.name == 'postgresql':
+        await session.execute(select(func.pg_notify(NOTIFY_CHANNEL, name)))
+
+
+async def get_data_version(session, name=TASTING_RECORDS):
+    """
+    Returns (version, updated_dt) pair or None if the data has never been changed
+    """
+    result = await session.execute(
+        select(DataVersion.version, DataVersion.updated_dt).where(DataVersion.name == name)
+    )
+    return result.one_or_none()
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from winey.images import variant_key, ORIGINAL
+
+
+# format -> content type
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+FIELDS = ('id', 'dt', 'wine_name', 'region', 'grapes', 'vintage_year', 'experience', 'photos')
+CHUNK_SIZE = 64 * 1024
+
+
+def export_row(tasting_record, photos_base_url):
+    return {
+        'id': tasting_record.id,
+        'dt': tasting_record.dt.isoformat(),
+        'wine_name': tasting_record.wine_name,
+        'region': tasting_record.region,
+        'grapes': tasting_record.grapes,
+        'vintage_year': tasting_record.vintage_year,
+        'experience': tasting_record.experience,
+        'photos': [
+            f'{photos_base_url}/{variant_key(ORIGINAL, photo.object_key)}'
+            for photo in tasting_record.photos if photo.is_uploaded
+        ],
+    }
+
+
+async def export_chunks(tasting_records, export_format, photos_base_url, chunk_size=CHUNK_SIZE):
+    """
+    Serializes async iterable of tasting records as CSV or JSON lines
+    into UTF-8 chunks of about `chunk_size` bytes
+    """
+    buffer = io.StringIO()
+    if export_format == 'csv':
+        # the BOM makes Excel read the file as UTF-8
+        buffer.write('\ufeff')
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+    async for tasting_record in tasting_records:
+        row = export_row(tasting_record, photos_base_url)
+        if export_format == 'csv':
+            writer.writerow({**row, 'photos': ' '.join(row['photos'])})
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
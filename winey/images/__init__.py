@@ -0,0 +1,74 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from winey.s3 import S3Client
+
+
+# variant name -> max width in pixels, originals narrower than a variant don't get it
+VARIANTS = {
+    'thumb': 320,
+    'card': 800,
+    'full': 1600,
+}
+ORIGINAL = 'original'
+PHOTOS_BASE_URL = os.environ.get(
+    'WINEY_PHOTOS_BASE_URL', 'https://storage.yandexcloud.net/evgene-petrenko-wine-bottles'
+)
+JPEG_QUALITY = 82
+
+
+def variant_key(name, key):
+    return key if name == ORIGINAL else f'{name}/{key}'
+
+
+def photo_sources(base_url, key, widths):
+    """
+    Returns `src` and `srcset` attribute values for a photo stored under `key` with variants of given `widths`
+    """
+    widths = widths or {}
+    return {
+        'src': f'{base_url}/{variant_key("card" if "card" in widths else ORIGINAL, key)}',
+        'srcset': ', '.join(
+            f'{base_url}/{variant_key(name, key)} {width}w'
+            for name, width in sorted(widths.items(), key=lambda item: item[1])
+        ),
+    }
+
+
+def render_variants(image_bytes):
+    """
+    Downscales the image into VARIANTS, it is CPU bound, so it's meant to be run in a process pool.
+
+    Returns widths of the original and rendered variants along with rendered JPEG bytes
+    """
+    # Pillow is only needed in the pool's processes, the ones serving requests don't pay for the import
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        widths = {ORIGINAL: image.width}
+        rendered = {}
+        for name, width in VARIANTS.items():
+            if width >= image.width:
+                continue
+            variant = image.copy()
+            variant.thumbnail((width, image.height), Image.LANCZOS)
+            buf = io.BytesIO()
+            variant.save(buf, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            widths[name] = variant.width
+            rendered[name] = buf.getvalue()
+    return widths, rendered
+
+
+async def upload_variants(s3client: S3Client, process_pool: ProcessPoolExecutor, key, image: bytes):
+    """
+    Renders downscaled variants of the image in the process pool and uploads them concurrently.
+    Returns widths of the original and its variants
+    """
+    widths, rendered = await asyncio.get_running_loop().run_in_executor(process_pool, render_variants, image)
+    await asyncio.gather(*(
+        s3client.upload_bytes(variant_key(name, key), data, content_type='image/jpeg')
+        for name, data in rendered.items()
+    ))
+    return widths
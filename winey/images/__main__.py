@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.future import select
+from winey.db import OrmSession, init_orm, close_orm
+from winey.db.models import PhotoBlob, WinePhoto
+from winey.db.versions import bump_data_version
+from winey.s3 import S3Client
+from . import upload_variants
+
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger('winey.images')
+
+BATCH_SIZE = 100
+CONCURRENCY = int(os.environ.get('WINEY_IMAGE_BACKFILL_CONCURRENCY', 8))
+
+
+async def backfill_photo(s3client, process_pool, semaphore, key):
+    async with semaphore:
+        image = await s3client.get_object(key)
+        return await upload_variants(s3client, process_pool, key, image)
+
+
+async def main():
+    """
+    Renders variants of already uploaded photos which don't have them yet
+    """
+    init_orm()
+    s3client = S3Client.from_environment(
+        os.environ['WINEY_S3_ENDPOINT_URL'],
+        os.environ['WINEY_S3_WINE_PHOTOS_BUCKET'],
+        max_concurrency=CONCURRENCY,
+    )
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    last_key = ''
+    with ProcessPoolExecutor() as process_pool:
+        while True:
+            async with OrmSession() as session:
+                select_stmt = select(WinePhoto.object_key) \
+                    .where(WinePhoto.is_uploaded, WinePhoto.variants.is_(None), WinePhoto.object_key > last_key) \
+                    .distinct() \
+                    .order_by(WinePhoto.object_key) \
+                    .limit(BATCH_SIZE)
+                keys = (await session.execute(select_stmt)).scalars().all()
+            if not keys:
+                break
+            results = await asyncio.gather(
+                *(backfill_photo(s3client, process_pool, semaphore, key) for key in keys),
+                return_exceptions=True,
+            )
+            async with OrmSession() as session:
+                for key, result in zip(keys, results):
+                    if isinstance(result, Exception):
+                        log.error(f'Could not render variants of {key}: {result!r}')
+                        continue
+                    await session.execute(
+                        update(WinePhoto).where(WinePhoto.object_key == key).values(variants=result)
+                    )
+                    # photos stored later copy variants of the blob sharing their content
+                    await session.execute(
+                        update(PhotoBlob).where(PhotoBlob.object_key == key).values(variants=result)
+                    )
+                await bump_data_version(session)
+                await session.commit()
+            log.info(f'Processed {len(keys)} photos up to {keys[-1]}')
+            last_key = keys[-1]
+    await s3client.close()
+    await close_orm()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
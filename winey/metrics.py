@@ -0,0 +1,221 @@
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from sqlalchemy import event
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(text, quote=False):
+    """
+    Escapes backslashes and line feeds, and double quotes of label values, as the text format requires
+    """
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value, quote=True)}"' for name, value in labels) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, key, value
+
+    def expose(self):
+        yield f'# HELP {self.name} {_escape(self.documentation)}'
+        yield f'# TYPE {self.name} {self.type}'
+        for name, labels, value in self.samples():
+            yield f'{name}{_format_labels(labels)} {value}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class CallbackMetric(Metric):
+    """
+    Counter or gauge which reads its value from `callback` on every scrape,
+    handy for exposing counts objects already keep track of
+    """
+
+    def __init__(self, name, documentation, callback, type='gauge'):
+        self.callback = callback
+        self.type = type
+        super().__init__(name, documentation)
+
+    def samples(self):
+        yield self.name, (), self.callback()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, series in self._values.items():
+            for bound, count in zip(self.buckets, series['buckets']):
+                yield f'{self.name}_bucket', key + (('le', str(bound)),), count
+            yield f'{self.name}_bucket', key + (('le', '+Inf'),), series['count']
+            yield f'{self.name}_sum', key, series['sum']
+            yield f'{self.name}_count', key, series['count']
+
+
+class Registry:
+    """
+    Collection of metrics exposed in Prometheus text format
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric):
+        self._metrics[metric.name] = metric
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+handler_duration = Histogram(
+    'winey_handler_duration_seconds', 'Time spent in bot and web handlers', ['handler'])
+handlers_in_progress = Gauge(
+    'winey_handlers_in_progress', 'Bot and web handlers being executed right now', ['handler'])
+db_query_duration = Histogram(
+    'winey_db_query_duration_seconds', 'Time spent executing SQL statements', ['operation'])
+db_queries_in_progress = Gauge(
+    'winey_db_queries_in_progress', 'SQL statements being executed right now')
+s3_request_duration = Histogram(
+    'winey_s3_request_duration_seconds', 'Time spent in S3 requests', ['method'])
+s3_upload_duration = Histogram(
+    'winey_s3_upload_duration_seconds', 'Time spent uploading whole objects to S3')
+s3_uploads_in_progress = Gauge(
+    'winey_s3_uploads_in_progress', 'S3 uploads being executed right now')
+telegram_download_duration = Histogram(
+    'winey_telegram_download_duration_seconds', 'Time spent downloading files from Telegram')
+throttled_updates = Counter(
+    'winey_bot_throttled_updates', 'Messages dropped because of sending too fast', ['scope'])
+startup_phase_duration = Gauge(
+    'winey_startup_phase_duration_seconds', 'Time spent in phases of the process start', ['phase'])
+
+
+def instrument_engine(engine):
+    """
+    Measures execution time of every statement run by the (async) engine
+    """
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_queries_in_progress.inc()
+        context._winey_query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_queries_in_progress.dec()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+        db_query_duration.observe(time.perf_counter() - context._winey_query_start, operation=operation)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(exception_context):
+        if exception_context.execution_context is not None \
+                and hasattr(exception_context.execution_context, '_winey_query_start'):
+            db_queries_in_progress.dec()
+
+
+async def metrics_handler(_):
+    return web.Response(
+        body=REGISTRY.expose().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+    )
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    route = request.match_info.route.resource
+    name = route.canonical if route is not None else 'unmatched'
+    with handlers_in_progress.track_in_progress(handler=name), handler_duration.time(handler=name):
+        return await handler(request)
+
+
+async def start_metrics_server(host, port, reuse_port=False):
+    """
+    Serves /metrics for processes which don't have their own web application
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, reuse_port=reuse_port).start()
+    return runner
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import aiohttp
+from yarl import URL
+from winey.metrics import s3_request_duration, s3_upload_duration, s3_uploads_in_progress
+
+
+log = logging.getLogger(__name__)
+
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+EMPTY_PAYLOAD_SHA256 = hashlib.sha256(b'').hexdigest()
+MIN_PART_SIZE = 5 * 1024 * 1024
+FILE_CHUNK_SIZE = 64 * 1024
+S3_XMLNS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+
+class S3Error(Exception):
+
+    def __init__(self, method, key, status, body):
+        super().__init__(f'{method} {key} failed with status {status}: {body[:512]!r}')
+        self.status = status
+
+
+def _quote(value, safe='-_.~'):
+    return quote(value, safe=safe)
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+async def _iter_file(file, chunk_size=FILE_CHUNK_SIZE):
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class S3Client:
+    """
+    Minimal asyncio S3 client which streams objects over a pooled aiohttp connection.
+
+    Requests are signed with AWS Signature Version 4 and unsigned payloads, objects are addressed
+    path-style ({endpoint_url}/{bucket}/{key}), so any S3 compatible storage (including local stand-ins)
+    works. At most `max_concurrency` uploads run at the same time, each of them holds in memory
+    no more than a single `part_size` part
+    """
+
+    def __init__(self, endpoint_url, bucket, credentials, region,
+                 part_size=8 * 1024 * 1024, max_concurrency=4, max_connections=16):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f'Part size must be at least {MIN_PART_SIZE} bytes')
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.host = urlsplit(self.endpoint_url).netloc
+        self.bucket = bucket
+        self.credentials = credentials
+        self.region = region
+        self.part_size = part_size
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    @classmethod
+    def from_environment(cls, endpoint_url, bucket, **kwargs):
+        """
+        Resolves credentials and region the same way boto3 does (environment variables, ~/.aws files, etc.)
+        """
+        # botocore takes a while to import and is only needed here
+        import botocore.session
+
+        session = botocore.session.get_session()
+        return cls(
+            endpoint_url,
+            bucket,
+            session.get_credentials(),
+            session.get_config_variable('region') or 'us-east-1',
+            **kwargs
+        )
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                raise_for_status=False,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _sign(self, method, path, query, headers, payload_hash):
+        credentials = self.credentials.get_frozen_credentials()
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f'{now.strftime("%Y%m%d")}/{self.region}/s3/aws4_request'
+
+        signed = {
+            'host': self.host,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+        }
+        if credentials.token:
+            signed['x-amz-security-token'] = credentials.token
+        signed_headers = ';'.join(sorted(signed))
+        canonical_request = '\n'.join([
+            method,
+            path,
+            query,
+            ''.join(f'{name}:{signed[name]}\n' for name in sorted(signed)),
+            signed_headers,
+            payload_hash,
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signing_key = _hmac(('AWS4' + credentials.secret_key).encode(), now.strftime('%Y%m%d'))
+        for part in (self.region, 's3', 'aws4_request'):
+            signing_key = _hmac(signing_key, part)
+        signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        del signed['host']
+        signed['Authorization'] = f'AWS4-HMAC-SHA256 Credential={credentials.access_key}/{scope}, ' \
+                                  f'SignedHeaders={signed_headers}, Signature={signature}'
+        return {**headers, **signed}
+
+    async def _request(self, method, key, params=None, headers=None, data=None, payload_hash=UNSIGNED_PAYLOAD):
+        path = _quote(f'/{self.bucket}/{key}', safe='/-_.~')
+        query = '&'.join(f'{_quote(name)}={_quote(value)}' for name, value in sorted((params or {}).items()))
+        headers = self._sign(method, path, query, headers or {}, payload_hash)
+        url = URL(f'{self.endpoint_url}{path}' + (f'?{query}' if query else ''), encoded=True)
+        with s3_request_duration.time(method=method):
+            async with self._get_session().request(method, url, headers=headers, data=data) as response:
+                body = await response.read()
+            if response.status >= 300:
+                raise S3Error(method, key, response.status, body)
+            return response.headers, body
+
+    async def put_object(self, key, body, content_length, content_type='binary/octet-stream'):
+        """
+        `body` is either bytes or an async iterable of chunks which must sum up to `content_length` bytes
+        """
+        await self._request('PUT', key, headers={
+            'Content-Length': str(content_length),
+            'Content-Type': content_type,
+        }, data=body)
+
+    async def get_object(self, key):
+        _, body = await self._request('GET', key, payload_hash=EMPTY_PAYLOAD_SHA256)
+        return body
+
+    async def delete_object(self, key):
+        await self._request('DELETE', key, payload_hash=EMPTY_PAYLOAD_SHA256)
+
+    async def upload_stream(self, key, chunks, size=None, content_type='binary/octet-stream'):
+        """
+        Uploads async iterable of byte chunks.
+        Streams of known size not exceeding the part size are piped into a single PUT,
+        other streams are uploaded part by part with a multipart upload
+        """
+        async with self._semaphore:
+            with s3_uploads_in_progress.track_in_progress(), s3_upload_duration.time():
+                await self._upload_stream(key, chunks, size, content_type)
+
+    async def upload_file(self, key, file, size, content_type='binary/octet-stream'):
+        """
+        Uploads `size` bytes of a local (e.g. temporary) file from its start, chunk by chunk
+        """
+        await self.upload_stream(key, _iter_file(file), size, content_type)
+
+    async def upload_bytes(self, key, data, content_type='binary/octet-stream'):
+        async with self._semaphore:
+            with s3_uploads_in_progress.track_in_progress(), s3_upload_duration.time():
+                await self.put_object(key, data, len(data), content_type)
+
+    async def _upload_stream(self, key, chunks, size, content_type):
+        if size is not None and size <= self.part_size:
+            await self.put_object(key, chunks, size, content_type)
+            return
+
+        chunks = chunks.__aiter__()
+        first_part = await self._read_part(chunks)
+        if len(first_part) < self.part_size:
+            await self.put_object(key, bytes(first_part), len(first_part), content_type)
+            return
+        await self._multipart_upload(key, first_part, chunks, content_type)
+
+    async def _read_part(self, chunks, buffer=None):
+        buffer = buffer if buffer is not None else bytearray()
+        while len(buffer) < self.part_size:
+            try:
+                buffer += await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        return buffer
+
+    async def _multipart_upload(self, key, buffer, chunks, content_type):
+        _, body = await self._request('POST', key, params={'uploads': ''}, headers={'Content-Type': content_type})
+        upload_id = ElementTree.fromstring(body).findtext(f'{S3_XMLNS}UploadId')
+        log.info(f'Started multipart upload {upload_id} of {key}')
+        etags = []
+        try:
+            while buffer:
+                part, buffer = bytes(buffer[:self.part_size]), buffer[self.part_size:]
+                response_headers, _ = await self._request(
+                    'PUT', key,
+                    params={'partNumber': str(len(etags) + 1), 'uploadId': upload_id},
+                    headers={'Content-Length': str(len(part))},
+                    data=part,
+                )
+                etags.append(response_headers['ETag'])
+                buffer = await self._read_part(chunks, buffer)
+
+            complete = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>'
+                for number, etag in enumerate(etags, start=1)
+            )
+            complete = f'<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>'.encode()
+            _, body = await self._request(
+                'POST', key,
+                params={'uploadId': upload_id},
+                data=complete,
+                payload_hash=hashlib.sha256(complete).hexdigest(),
+            )
+            # completion errors can come with 200 status
+            if ElementTree.fromstring(body).tag == 'Error':
+                raise S3Error('POST', key, 200, body)
+        except Exception:
+            log.warning(f'Aborting multipart upload {upload_id} of {key}')
+            await self._request('DELETE', key, params={'uploadId': upload_id}, payload_hash=EMPTY_PAYLOAD_SHA256)
+            raise
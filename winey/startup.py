@@ -0,0 +1,33 @@
+import logging
+import time
+from winey.metrics import startup_phase_duration
+
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Splits process start into phases (imports, engine, clients...) marked one after another,
+    so it's clear what slow restarts are paying for
+    """
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = {}
+        self._last_mark = self.start
+
+    def mark(self, phase):
+        """
+        Records time passed since the previous mark as `phase`
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last_mark
+        self._last_mark = now
+
+    def report(self, name):
+        total = self._last_mark - self.start
+        for phase, duration in self.phases.items():
+            startup_phase_duration.set(duration, phase=phase)
+        phases = ', '.join(f'{phase} {duration:.3f} s' for phase, duration in self.phases.items())
+        log.info(f'{name} started in {total:.3f} s: {phases}')
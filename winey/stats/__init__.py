@@ -0,0 +1,122 @@
+import re
+from collections import Counter
+from sqlalchemy import delete, text
+from sqlalchemy.future import select
+from winey.db.dialects import dialect_insert
+from winey.db.models import TastingRecord, TastingStat
+
+
+ALL_USERS = 0
+TOTAL = 'total'
+REGION = 'region'
+GRAPE = 'grape'
+DECADE = 'decade'
+WINE = 'wine'
+MONTH = 'month'
+# dimensions shown as top lists
+TOP_DIMENSIONS = (REGION, GRAPE, DECADE, WINE)
+MAX_VALUE_LENGTH = 256
+INSERT_BATCH_SIZE = 1000
+
+GRAPES_SEPARATOR = re.compile(r'\s*(?:[,;/+&]|\s-\s|\sи\s)\s*', re.IGNORECASE)
+PERCENTAGE = re.compile(r'\d+([.,]\d+)?\s*%')
+
+
+def normalize(value):
+    return ' '.join(value.split()).lower()[:MAX_VALUE_LENGTH]
+
+
+def split_grapes(grapes):
+    """
+    Splits free form list of grapes, e.g. "Каберне Совиньон 60%, Мерло и Каберне Фран"
+    """
+    # percentages go first, decimal commas in them aren't separators
+    return [
+        grape for grape in (normalize(part) for part in GRAPES_SEPARATOR.split(PERCENTAGE.sub('', grapes)))
+        if grape and grape != '-'
+    ]
+
+
+def stat_keys(tasting_record: TastingRecord):
+    """
+    Returns (dimension, value) pairs the record counts towards
+    """
+    keys = [(TOTAL, ''), (REGION, normalize(tasting_record.region)), (WINE, normalize(tasting_record.wine_name))]
+    keys.extend((GRAPE, grape) for grape in set(split_grapes(tasting_record.grapes)))
+    if tasting_record.vintage_year:
+        keys.append((DECADE, str(tasting_record.vintage_year // 10 * 10)))
+    keys.append((MONTH, f'{tasting_record.dt:%Y-%m}'))
+    return [(dimension, value) for dimension, value in keys if dimension == TOTAL or value]
+
+
+def _counts(tasting_records):
+    counts = Counter()
+    for tasting_record in tasting_records:
+        for dimension, value in stat_keys(tasting_record):
+            counts[tasting_record.user_id, dimension, value] += 1
+            counts[ALL_USERS, dimension, value] += 1
+    return counts
+
+
+async def _increment(session, counts):
+    for rows in _batches([
+        {'user_id': user_id, 'dimension': dimension, 'value': value, 'count': count}
+        for (user_id, dimension, value), count in counts.items()
+    ]):
+        insert_stmt = dialect_insert(session, TastingStat).values(rows)
+        await session.execute(insert_stmt.on_conflict_do_update(
+            index_elements=[TastingStat.user_id, TastingStat.dimension, TastingStat.value],
+            set_={'count': TastingStat.count + insert_stmt.excluded.count},
+        ))
+
+
+def _batches(rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        yield rows[start:start + INSERT_BATCH_SIZE]
+
+
+async def add_to_stats(session, *tasting_records: TastingRecord):
+    """
+    Counts new records in the session's transaction, so stats change atomically with the records
+    """
+    await _increment(session, _counts(tasting_records))
+
+
+async def rebuild_stats(session, tasting_records):
+    """
+    Replaces stats with the ones counted over async iterable of all `tasting_records`.
+    On PostgreSQL the table is locked first, so records added meanwhile are counted once,
+    after the rebuild is committed
+    """
+    if session.bind.dialect.name == 'postgresql':
+        await session.execute(text('LOCK TABLE tasting_stats IN EXCLUSIVE MODE'))
+    await session.execute(delete(TastingStat))
+    counts = Counter()
+    async for tasting_record in tasting_records:
+        counts.update(_counts([tasting_record]))
+    await _increment(session, counts)
+    return counts[ALL_USERS, TOTAL, '']
+
+
+async def fetch_stats(session, user_id=ALL_USERS, top=5, months=12):
+    """
+    Returns total number of records, `top` values of every dimension of TOP_DIMENSIONS
+    and record counts of the latest `months` months, all read from precomputed rows
+    """
+    async def fetch(dimension, order_by, limit):
+        result = await session.execute(
+            select(TastingStat.value, TastingStat.count)
+            .where(TastingStat.user_id == user_id, TastingStat.dimension == dimension)
+            .order_by(*order_by)
+            .limit(limit)
+        )
+        return [tuple(row) for row in result]
+
+    total = await fetch(TOTAL, [], 1)
+    stats = {
+        TOTAL: total[0][1] if total else 0,
+        MONTH: list(reversed(await fetch(MONTH, [TastingStat.value.desc()], months))),
+    }
+    for dimension in TOP_DIMENSIONS:
+        stats[dimension] = await fetch(dimension, [TastingStat.count.desc(), TastingStat.value], top)
+    return stats
@@ -0,0 +1,29 @@
+import asyncio
+import logging
+from winey.db import OrmSession, init_orm, close_orm
+from winey.db.queries import stream_tasting_records
+from winey.db.versions import bump_data_version
+from . import rebuild_stats
+
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger('winey.stats')
+
+
+async def main():
+    """
+    Recounts tasting stats from scratch, needed once after the table is created
+    and whenever the way records are counted changes
+    """
+    init_orm()
+    async with OrmSession() as session:
+        async with OrmSession() as read_session:
+            total = await rebuild_stats(session, stream_tasting_records(read_session))
+        await bump_data_version(session)
+        await session.commit()
+    log.info(f'Counted {total} tasting records')
+    await close_orm()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Token bucket per key: a key may spend up to `burst` tokens at once, which are refilled
+    at `rate` tokens per second. Non-positive rate disables limiting.
+
+    A bucket untouched for long enough to refill is indistinguishable from a new one, so such buckets
+    are evicted and memory stays proportional to the number of recently active keys (at most `max_size`)
+    """
+
+    def __init__(self, rate, burst, max_size=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self._refill_time = burst / rate if rate > 0 else 0
+        # key -> (tokens, last update time), least recently updated first
+        self._buckets = OrderedDict()
+
+    def acquire(self, key, tokens=1):
+        """
+        Takes `tokens` from the key's bucket, returns False leaving the bucket intact if there are not enough
+        """
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self._evict_idle(now)
+        available, updated = self._buckets.pop(key, (self.burst, now))
+        available = min(self.burst, available + (now - updated) * self.rate)
+        allowed = available >= tokens
+        if allowed:
+            available -= tokens
+        self._buckets[key] = (available, now)
+        if len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def release(self, key, tokens=1):
+        """
+        Gives back `tokens` taken from the key's bucket, e.g. when what they were taken for didn't happen
+        """
+        if key not in self._buckets:
+            return
+        available, updated = self._buckets[key]
+        self._buckets[key] = (min(self.burst, available + tokens), updated)
+
+    def _evict_idle(self, now):
+        while self._buckets:
+            _, updated = next(iter(self._buckets.values()))
+            if now - updated < self._refill_time:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
@@ -1,53 +1,63 @@
+import time
+
+started = time.perf_counter()
+
+import logging
 import os
 from aiohttp import web
-from sqlalchemy.orm import selectinload
-from sqlalchemy.future import select
-import aiohttp_jinja2
-import jinja2
-from winey.db.models import TastingRecord
-from winey.db import OrmSession
-
-
-@aiohttp_jinja2.template('index.html')
-async def index(_):
-    return {}
-
-
-@aiohttp_jinja2.template('tasting_sessions.html')
-async def handle(_):
-    async with OrmSession() as session:
-        select_stmt = select(TastingRecord) \
-            .options(
-            selectinload(TastingRecord.photos)
-        ).order_by(TastingRecord.dt.desc())
-        tasting_records_result = await session.execute(select_stmt)
-
-        return {
-            'tasting_records': [
-                {
-                    'dt': tasting_record.dt,
-                    'wine_name': tasting_record.wine_name,
-                    'region': tasting_record.region,
-                    'grapes': tasting_record.grapes,
-                    'vintage_year': tasting_record.vintage_year,
-                    'experience': tasting_record.experience,
-                    'photos': [
-                        {
-                            'id': photo.id
-                         } for photo in tasting_record.photos
-                    ]
-                } for tasting_record in tasting_records_result.scalars()
-            ],
-        }
-
-
-app = web.Application()
-aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader('./winey/webapp/templates'))
-app.add_routes([
-    web.get('/wine-log', handle),
-    web.get('/', index),
-])
+from winey.startup import StartupTimer
+
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger('winey.webapp')
+
+
+def engine_kwargs(workers):
+    """
+    WINEY_WEBAPP_DB_POOL_SIZE and WINEY_WEBAPP_DB_MAX_OVERFLOW limit connections of all workers together,
+    so adding workers doesn't multiply the load on the database. SQLAlchemy defaults are used per worker if unset.
+    On PostgreSQL every worker also keeps a LISTEN connection of its own outside of the pool
+    """
+    kwargs = {}
+    if 'WINEY_WEBAPP_DB_POOL_SIZE' in os.environ:
+        pool_size = int(os.environ['WINEY_WEBAPP_DB_POOL_SIZE'])
+        kwargs['pool_size'] = max(1, pool_size // workers)
+        if kwargs['pool_size'] * workers > pool_size:
+            log.warning(f'WINEY_WEBAPP_DB_POOL_SIZE={pool_size} is less than a connection per worker, '
+                        f'{workers} workers will keep up to {kwargs["pool_size"] * workers} connections')
+    if 'WINEY_WEBAPP_DB_MAX_OVERFLOW' in os.environ:
+        kwargs['max_overflow'] = int(os.environ['WINEY_WEBAPP_DB_MAX_OVERFLOW']) // workers
+    return kwargs
 
 
 if __name__ == '__main__':
-    web.run_app(app, port=os.environ.get('WINEY_WEBAPP_PORT', 8080))
+    host = os.environ.get('WINEY_WEBAPP_HOST', '0.0.0.0')
+    port = int(os.environ.get('WINEY_WEBAPP_PORT', 8080))
+    # 0 means a worker per available CPU
+    workers = int(os.environ.get('WINEY_WEBAPP_WORKERS', 1)) or len(os.sched_getaffinity(0))
+    # a log line per request costs some throughput, the log can be turned off when it's not needed
+    access_log = os.environ.get('WINEY_WEBAPP_ACCESS_LOG', '1').lower() in ('1', 'true', 'yes')
+    if workers == 1:
+        from .app import create_app
+        startup_timer = StartupTimer(started)
+        startup_timer.mark('import')
+        web.run_app(
+            create_app(startup_timer, engine_kwargs(workers)),
+            host=host,
+            port=port,
+            access_log=web.access_logger if access_log else None,
+        )
+    else:
+        from .prefork import PreforkServer
+        metrics_port = os.environ.get('WINEY_WEBAPP_METRICS_PORT')
+        PreforkServer(
+            host,
+            port,
+            workers,
+            reuse_port=os.environ.get('WINEY_WEBAPP_REUSE_PORT', '').lower() in ('1', 'true', 'yes'),
+            worker_timeout=float(os.environ.get('WINEY_WEBAPP_WORKER_TIMEOUT', 30)),
+            shutdown_timeout=float(os.environ.get('WINEY_WEBAPP_SHUTDOWN_TIMEOUT', 30)),
+            engine_kwargs=engine_kwargs(workers),
+            metrics_port=int(metrics_port) if metrics_port else None,
+            access_log=access_log,
+        ).run()
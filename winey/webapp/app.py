@@ -0,0 +1,76 @@
+import os
+from aiohttp import web
+import aiohttp_jinja2
+import jinja2
+from winey.cache import LRUCache
+from winey.db import OrmSession, init_orm, close_orm
+from winey.metrics import CallbackMetric, metrics_handler, metrics_middleware
+from winey.startup import StartupTimer
+from .cache import DataVersionWatcher
+from .handlers import index, handle, export, stats, api_tasting_records, api_tasting_record
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+
+def create_app(startup_timer: StartupTimer = None, engine_kwargs=None):
+    """
+    Builds the web application, the database engine (configured with `engine_kwargs`, e.g. pool size)
+    is created on startup and disposed on cleanup
+    """
+    startup_timer = startup_timer or StartupTimer()
+    app = web.Application(middlewares=[metrics_middleware])
+    page_cache = app['page_cache'] = LRUCache(int(os.environ.get('WINEY_WEBAPP_PAGE_CACHE_SIZE', 128)))
+    CallbackMetric('winey_page_cache_hits', 'Pages served from cache', lambda: page_cache.hits, 'counter')
+    CallbackMetric('winey_page_cache_misses', 'Pages rendered from the database', lambda: page_cache.misses, 'counter')
+    app.cleanup_ctx.append(database_context(startup_timer, engine_kwargs or {}))
+    setup_templates(app)
+    startup_timer.mark('templates')
+    app.add_routes([
+        web.get('/wine-log', handle),
+        web.get('/wine-log/export', export),
+        web.get('/wine-log/stats', stats),
+        web.get('/api/v1/tasting-records', api_tasting_records),
+        web.get(r'/api/v1/tasting-records/{record_id:\d+}', api_tasting_record),
+        web.get(r'/api/v1/users/{user_id:\d+}/tasting-records', api_tasting_records),
+        web.get('/', index),
+        web.get('/metrics', metrics_handler),
+    ])
+    startup_timer.mark('application')
+    return app
+
+
+def setup_templates(app):
+    """
+    Templates are rendered asynchronously, so pages can be streamed while rows are fetched. They are compiled
+    once at startup and never reloaded, compiled bytecode is cached on disk for the next start
+    """
+    env = aiohttp_jinja2.setup(
+        app,
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        # defaults to a per user directory under the system temporary directory
+        bytecode_cache=jinja2.FileSystemBytecodeCache(os.environ.get('WINEY_WEBAPP_TEMPLATE_CACHE_DIR')),
+        enable_async=True,
+        auto_reload=False,
+    )
+    for template_name in env.list_templates(extensions=['html']):
+        env.get_template(template_name)
+
+
+def database_context(startup_timer: StartupTimer, engine_kwargs):
+    async def context(app):
+        engine = init_orm(**engine_kwargs)
+        app['data_version_watcher'] = DataVersionWatcher(
+            engine,
+            OrmSession,
+            app['page_cache'],
+            poll_interval=float(os.environ.get('WINEY_WEBAPP_CACHE_POLL_INTERVAL', 5)),
+        )
+        await app['data_version_watcher'].start()
+        startup_timer.mark('database')
+        startup_timer.report('Webapp')
+        yield
+        await app['data_version_watcher'].stop()
+        await close_orm()
+
+    return context
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from datetime import timezone
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from winey.cache import LRUCache
+from winey.db.versions import get_data_version, NOTIFY_CHANNEL
+
+
+log = logging.getLogger(__name__)
+
+
+class DataVersionWatcher:
+    """
+    Keeps track of the tasting records data version and clears the page cache when it changes.
+
+    The version is polled from the database every `poll_interval` seconds. On PostgreSQL
+    the watcher also LISTENs to notifications sent by bump_data_version, so changes are picked up
+    right after the bot commits them and polling is only a safety net. The LISTEN connection is opened
+    outside of the engine's pool, so it doesn't take a connection away from requests
+    """
+
+    def __init__(self, engine, session_factory, page_cache: LRUCache, poll_interval):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.page_cache = page_cache
+        self.poll_interval = poll_interval
+        self.version = None
+        self.updated_dt = None
+        self._wakeup = asyncio.Event()
+        self._listen_engine = None
+        self._listen_conn = None
+        self._listen_raw_conn = None
+        self._poll_task = None
+
+    async def refresh(self):
+        async with self.session_factory() as session:
+            row = await get_data_version(session)
+        version, updated_dt = row if row is not None else (0, None)
+        if version != self.version:
+            log.info(f'Data version changed from {self.version} to {version}, clearing {len(self.page_cache)} pages')
+            self.page_cache.clear()
+            self.version = version
+            # SQLite gives naive datetimes back
+            self.updated_dt = updated_dt and updated_dt.replace(tzinfo=updated_dt.tzinfo or timezone.utc)
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception('Could not refresh data version')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _on_notification(self, *_):
+        self._wakeup.set()
+
+    async def start(self, _=None):
+        if self.engine.dialect.name == 'postgresql':
+            self._listen_engine = create_async_engine(self.engine.url, poolclass=NullPool)
+            self._listen_conn = await self._listen_engine.connect()
+            self._listen_raw_conn = (await self._listen_conn.get_raw_connection()).driver_connection
+            await self._listen_raw_conn.add_listener(NOTIFY_CHANNEL, self._on_notification)
+        await self.refresh()
+        self._poll_task = asyncio.create_task(self._poll())
+
+    async def stop(self, _=None):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self._listen_conn is not None:
+            await self._listen_raw_conn.remove_listener(NOTIFY_CHANNEL, self._on_notification)
+            await self._listen_conn.close()
+            await self._listen_engine.dispose()
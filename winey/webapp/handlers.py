@@ -0,0 +1,239 @@
+import json
+import os
+from aiohttp import web
+import aiohttp_jinja2
+from winey.db import OrmSession
+from winey.db.queries import (
+    TastingRecordsPageStream, fetch_tasting_records_page, fetch_tasting_record, stream_tasting_records,
+)
+from winey.export import FORMATS as EXPORT_FORMATS, export_chunks
+from winey.images import PHOTOS_BASE_URL, photo_sources
+from winey.stats import ALL_USERS, TOP_DIMENSIONS, fetch_stats
+from .responses import (
+    StreamCompressor, accepted_encoding, encode_body, not_modified, versioned_response, versioned_stream_response,
+)
+
+
+PAGE_SIZE = int(os.environ.get('WINEY_WEBAPP_PAGE_SIZE', 20))
+API_MAX_PAGE_SIZE = int(os.environ.get('WINEY_WEBAPP_API_MAX_PAGE_SIZE', 100))
+# streamed pages larger than this are sent, but not cached
+MAX_CACHED_PAGE_SIZE = int(os.environ.get('WINEY_WEBAPP_MAX_CACHED_PAGE_SIZE', 1024 * 1024))
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+@aiohttp_jinja2.template('index.html')
+async def index(_):
+    return {}
+
+
+async def cached_response(request, cache_key, content_type, render):
+    """
+    Answers with 304 if the client has the current data version, otherwise serves the body
+    compressed for the client, rendering it with `render` coroutine function on cache misses.
+    The body is looked up even for 304: whether it's compressed, and so its ETag, depends on its size,
+    and `render` raising HTTP errors, e.g. for missing resources, answers conditional requests too
+    """
+    page_cache, data_version_watcher = request.app['page_cache'], request.app['data_version_watcher']
+    version, updated_dt = data_version_watcher.version, data_version_watcher.updated_dt
+    cache_key = cache_key + (accepted_encoding(request),)
+    cached = page_cache.get(cache_key)
+    if cached is None:
+        cached = encode_body(await render(), cache_key[-1])
+        # the body could have been rendered from already outdated data
+        if version == data_version_watcher.version:
+            page_cache.put(cache_key, cached)
+    encoding, body = cached
+    response = not_modified(request, version, updated_dt, encoding)
+    if response is not None:
+        return response
+    return versioned_response(body, content_type, version, updated_dt, encoding)
+
+
+async def streamed_response(request, cache_key, content_type, generate):
+    """
+    Same as `cached_response`, but on cache misses the body is sent while `generate` async generator function
+    is still producing it, so neither the time to the first byte nor memory use grow with the body.
+    Bodies up to MAX_CACHED_PAGE_SIZE are cached as they are sent
+    """
+    page_cache, data_version_watcher = request.app['page_cache'], request.app['data_version_watcher']
+    version, updated_dt = data_version_watcher.version, data_version_watcher.updated_dt
+    cache_key = cache_key + (accepted_encoding(request),)
+    # streamed bodies are compressed whatever their size
+    response = not_modified(request, version, updated_dt, cache_key[-1])
+    if response is not None:
+        return response
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        encoding, body = cached
+        return versioned_response(body, content_type, version, updated_dt, encoding)
+
+    compressor = StreamCompressor(cache_key[-1])
+    response = versioned_stream_response(content_type, version, updated_dt, compressor.encoding)
+    await response.prepare(request)
+    parts, size = [], 0
+    async for chunk in generate():
+        chunk = compressor.compress(chunk)
+        await response.write(chunk)
+        size += len(chunk)
+        if size > MAX_CACHED_PAGE_SIZE:
+            parts = None
+        elif parts is not None:
+            parts.append(chunk)
+    last_chunk = compressor.finish()
+    await response.write_eof(last_chunk)
+    if parts is not None and version == data_version_watcher.version:
+        page_cache.put(cache_key, (compressor.encoding, b''.join(parts) + last_chunk))
+    return response
+
+
+async def generate_template(template_name, request, context):
+    """
+    Yields the template rendered by the async Jinja environment in UTF-8 parts of about STREAM_CHUNK_SIZE,
+    values of `context` may be async iterables, which are consumed while the template is rendered
+    """
+    template = aiohttp_jinja2.get_env(request.app).get_template(template_name)
+    buffer, buffer_size = [], 0
+    async for text in template.generate_async(context):
+        buffer.append(text)
+        buffer_size += len(text)
+        if buffer_size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, buffer_size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+async def handle(request):
+    before = request.query.get('before')
+    query = request.query.get('q', '').strip()
+    try:
+        page = TastingRecordsPageStream(PAGE_SIZE, before, query)
+    except ValueError:
+        raise web.HTTPBadRequest(text='Malformed "before" cursor')
+
+    async def render():
+        async with OrmSession() as session:
+            tasting_records = (tasting_record_to_dict(tasting_record) async for tasting_record in page.stream(session))
+            async for chunk in generate_template('tasting_sessions.html', request, {
+                'tasting_records': tasting_records,
+                'query': query,
+                'is_first_page': before is None,
+                # next_cursor is known once tasting_records are rendered
+                'page': page,
+            }):
+                yield chunk
+
+    return await streamed_response(request, ('wine-log', before, query), 'text/html', render)
+
+
+async def api_tasting_records(request):
+    user_id = request.match_info.get('user_id')
+    user_id = int(user_id) if user_id is not None else None
+    before = request.query.get('before')
+    query = request.query.get('q', '').strip()
+    try:
+        limit = min(max(int(request.query.get('limit', PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise web.HTTPBadRequest(text='Malformed "limit"')
+
+    async def render():
+        async with OrmSession() as session:
+            tasting_records, next_cursor = await load_tasting_records_page(
+                session, limit, before, query, user_id=user_id
+            )
+        return dump_json({
+            'tasting_records': [tasting_record_to_dict(tasting_record) for tasting_record in tasting_records],
+            'next_cursor': next_cursor,
+        })
+
+    cache_key = ('api-tasting-records', user_id, before, query, limit)
+    return await cached_response(request, cache_key, 'application/json', render)
+
+
+async def api_tasting_record(request):
+    record_id = int(request.match_info['record_id'])
+
+    async def render():
+        async with OrmSession() as session:
+            tasting_record = await fetch_tasting_record(session, record_id)
+        if tasting_record is None:
+            raise web.HTTPNotFound(text=f'No tasting record {record_id}')
+        return dump_json(tasting_record_to_dict(tasting_record))
+
+    return await cached_response(request, ('api-tasting-record', record_id), 'application/json', render)
+
+
+async def export(request):
+    """
+    Streams tasting records, optionally only the ones of `user_id`, as CSV or JSON lines
+    """
+    export_format = request.query.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise web.HTTPBadRequest(text=f'Format should be one of {", ".join(EXPORT_FORMATS)}')
+    try:
+        user_id = int(request.query['user_id']) if 'user_id' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='Malformed "user_id"')
+
+    response = web.StreamResponse(headers={
+        'Content-Disposition': f'attachment; filename="winey.{export_format}"',
+    })
+    response.content_type = EXPORT_FORMATS[export_format]
+    response.charset = 'utf-8'
+    response.enable_chunked_encoding()
+    response.enable_compression()
+    await response.prepare(request)
+    async with OrmSession() as session:
+        async for chunk in export_chunks(stream_tasting_records(session, user_id), export_format, PHOTOS_BASE_URL):
+            await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def stats(request):
+    """
+    Shows the most frequent regions, grapes, vintages and wines, of everyone or of `user_id`
+    """
+    try:
+        user_id = int(request.query.get('user_id', ALL_USERS))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Malformed "user_id"')
+
+    async def render():
+        async with OrmSession() as session:
+            user_stats = await fetch_stats(session, user_id)
+        return (await aiohttp_jinja2.render_string_async('stats.html', request, {
+            'stats': user_stats,
+            'top_dimensions': TOP_DIMENSIONS,
+            'max_month_count': max((count for _, count in user_stats['month']), default=0),
+        })).encode()
+
+    return await cached_response(request, ('stats', user_id), 'text/html', render)
+
+
+async def load_tasting_records_page(session, limit, before, query, user_id=None):
+    try:
+        return await fetch_tasting_records_page(session, limit, before, query, user_id)
+    except ValueError:
+        raise web.HTTPBadRequest(text='Malformed "before" cursor')
+
+
+def tasting_record_to_dict(tasting_record):
+    return {
+        'id': tasting_record.id,
+        'user_id': tasting_record.user_id,
+        'dt': tasting_record.dt,
+        'wine_name': tasting_record.wine_name,
+        'region': tasting_record.region,
+        'grapes': tasting_record.grapes,
+        'vintage_year': tasting_record.vintage_year,
+        'experience': tasting_record.experience,
+        'photos': [
+            photo_sources(PHOTOS_BASE_URL, photo.object_key, photo.variants)
+            for photo in tasting_record.photos if photo.is_uploaded
+        ]
+    }
+
+
+def dump_json(obj):
+    return json.dumps(obj, ensure_ascii=False, default=lambda dt: dt.isoformat()).encode()
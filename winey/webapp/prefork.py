@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from multiprocessing.sharedctypes import RawArray
+from aiohttp import web
+from winey.metrics import start_metrics_server
+from winey.startup import StartupTimer
+
+
+log = logging.getLogger(__name__)
+
+SUPERVISED_SIGNALS = {signal.SIGCHLD, signal.SIGHUP, signal.SIGINT, signal.SIGTERM}
+HEARTBEAT_INTERVAL = 1
+MAX_RESTART_DELAY = 30
+
+
+class Worker:
+
+    def __init__(self, pid, index, slot, generation):
+        self.pid = pid
+        self.index = index
+        # position of the worker's heartbeat in the shared array
+        self.slot = slot
+        self.generation = generation
+        self.started = time.monotonic()
+        self.stopping_since = None
+
+
+class PreforkServer:
+    """
+    Runs `workers` webapp processes serving one port. By default the listening socket is created here
+    and inherited by the forked workers, with `reuse_port` every worker binds its own SO_REUSEPORT socket
+    and the kernel balances connections between them.
+
+    Workers import the application after they are forked and report they are alive by updating their heartbeat
+    in shared memory. The master restarts workers which exit and kills the ones whose heartbeat is older than
+    `worker_timeout` seconds (e.g. a blocked event loop).
+
+    SIGTERM and SIGINT stop workers gracefully, letting them finish requests for up to `shutdown_timeout` seconds.
+    SIGHUP starts a new worker for every running one, which is stopped as soon as its replacement serves requests,
+    so new code and templates are loaded without refusing connections.
+    Workers log every request unless `access_log` is off
+    """
+
+    def __init__(self, host, port, workers, reuse_port=False, worker_timeout=30, shutdown_timeout=30,
+                 engine_kwargs=None, metrics_port=None, access_log=True):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.worker_timeout = worker_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.engine_kwargs = engine_kwargs or {}
+        self.metrics_port = metrics_port
+        self.access_log = access_log
+        # room for a reload replacing all workers while another one is in progress
+        self._heartbeats = RawArray('d', 4 * workers)
+        self._workers = {}
+        self._generation = 0
+        self._stopping = False
+        self._restart_delays = [0] * workers
+        self._restart_at = [0] * workers
+        self._master_pid = os.getpid()
+        self._sock = None
+
+    def run(self):
+        signal.pthread_sigmask(signal.SIG_BLOCK, SUPERVISED_SIGNALS)
+        if not self.reuse_port:
+            self._sock = self._listen()
+        log.info(f'Starting {self.workers} workers on {self.host}:{self.port}')
+        self._spawn_missing()
+        while self._workers:
+            signal_info = signal.sigtimedwait(SUPERVISED_SIGNALS, HEARTBEAT_INTERVAL)
+            if signal_info is not None:
+                self._handle_signal(signal_info.si_signo)
+            self._reap()
+            self._supervise()
+            if not self._stopping:
+                self._spawn_missing()
+        if self._sock is not None:
+            self._sock.close()
+        log.info('All workers stopped')
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        return sock
+
+    def _handle_signal(self, signum):
+        if signum in (signal.SIGTERM, signal.SIGINT) and not self._stopping:
+            log.info(f'Got {signal.Signals(signum).name}, stopping workers')
+            self._stopping = True
+            for worker in self._workers.values():
+                self._stop(worker)
+        elif signum == signal.SIGHUP and not self._stopping:
+            self._generation += 1
+            log.info(f'Got SIGHUP, replacing workers with generation {self._generation}')
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            # negative for workers killed by a signal, as os.waitstatus_to_exitcode (Python 3.9+) reports it
+            exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            if worker.stopping_since is not None:
+                log.info(f'Worker {pid} stopped with code {exit_code}')
+                continue
+            log.error(f'Worker {pid} exited unexpectedly with code {exit_code}')
+            if not self._is_ready(worker):
+                # the worker didn't even start, restarting it right away would most likely fail the same way
+                delay = min(MAX_RESTART_DELAY, max(1, 2 * self._restart_delays[worker.index]))
+                self._restart_delays[worker.index] = delay
+                self._restart_at[worker.index] = time.monotonic() + delay
+                log.warning(f'Restarting worker {worker.index} in {delay} s')
+
+    def _supervise(self):
+        now = time.monotonic()
+        current = {
+            worker.index: worker for worker in self._workers.values()
+            if worker.generation == self._generation and worker.stopping_since is None
+        }
+        for worker in list(self._workers.values()):
+            if worker.stopping_since is not None:
+                if now - worker.stopping_since > self.shutdown_timeout + self.worker_timeout:
+                    log.error(f'Worker {worker.pid} has not stopped in time, killing it')
+                    self._kill(worker)
+            elif now - self._heartbeats[worker.slot] > self.worker_timeout:
+                log.error(f'Worker {worker.pid} has not responded for {self.worker_timeout} s, killing it')
+                self._kill(worker)
+                worker.stopping_since = now
+            elif worker.generation != self._generation:
+                replacement = current.get(worker.index)
+                if replacement is not None and self._is_ready(replacement):
+                    self._stop(worker)
+            elif self._is_ready(worker):
+                self._restart_delays[worker.index] = 0
+
+    def _spawn_missing(self):
+        now = time.monotonic()
+        running = {
+            worker.index for worker in self._workers.values()
+            if worker.generation == self._generation and worker.stopping_since is None
+        }
+        for index in range(self.workers):
+            if index not in running and now >= self._restart_at[index]:
+                self._spawn(index)
+
+    def _spawn(self, index):
+        used_slots = {worker.slot for worker in self._workers.values()}
+        slot = next((slot for slot in range(len(self._heartbeats)) if slot not in used_slots), None)
+        if slot is None:
+            log.warning(f'Too many workers are still stopping, postponing start of worker {index}')
+            return
+        self._heartbeats[slot] = time.monotonic()
+        worker = Worker(None, index, slot, self._generation)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISED_SIGNALS)
+                # reloads are the master's business
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                self._run_worker(worker)
+                exit_code = 0
+            except BaseException:
+                log.exception(f'Worker {index} failed')
+            finally:
+                logging.shutdown()
+                os._exit(exit_code)
+        worker.pid = pid
+        self._workers[pid] = worker
+        log.info(f'Started worker {index} (generation {worker.generation}) with pid {pid}')
+
+    def _run_worker(self, worker: Worker):
+        startup_timer = StartupTimer()
+        # imported in the worker, so a reload picks up new code
+        from .app import create_app
+        startup_timer.mark('import')
+        app = create_app(startup_timer, self.engine_kwargs)
+        if self.metrics_port is not None:
+            app.cleanup_ctx.append(metrics_context(self.metrics_port + worker.index))
+        # the heartbeat goes last, so the worker counts as ready once everything else has started
+        app.cleanup_ctx.append(self._heartbeat_context(worker.slot))
+        access_log = web.access_logger if self.access_log else None
+        if self.reuse_port:
+            web.run_app(app, host=self.host, port=self.port, reuse_port=True,
+                        shutdown_timeout=self.shutdown_timeout, access_log=access_log, print=None)
+        else:
+            web.run_app(app, sock=self._sock, shutdown_timeout=self.shutdown_timeout, access_log=access_log, print=None)
+
+    def _heartbeat_context(self, slot):
+        async def beat():
+            while True:
+                if os.getppid() != self._master_pid:
+                    log.warning('Master process is gone, stopping')
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+                self._heartbeats[slot] = time.monotonic()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+        async def context(_):
+            task = asyncio.create_task(beat())
+            yield
+            task.cancel()
+
+        return context
+
+    def _is_ready(self, worker: Worker):
+        return self._heartbeats[worker.slot] > worker.started
+
+    def _stop(self, worker: Worker):
+        if worker.stopping_since is None:
+            worker.stopping_since = time.monotonic()
+            self._signal(worker, signal.SIGTERM)
+
+    def _kill(self, worker: Worker):
+        self._signal(worker, signal.SIGKILL)
+
+    def _signal(self, worker: Worker, signum):
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def metrics_context(port):
+    """
+    Every worker has its own metrics, so they are served by each of them on a port of its own.
+    The port is shared with the worker being replaced during a reload
+    """
+    async def context(_):
+        runner = await start_metrics_server('0.0.0.0', port, reuse_port=True)
+        yield
+        await runner.cleanup()
+
+    return context
@@ -0,0 +1,160 @@
+import gzip
+import zlib
+from email.utils import format_datetime, parsedate_to_datetime
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+MIN_COMPRESSED_SIZE = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def accepted_encoding(request):
+    """
+    Returns the best content coding out of ENCODINGS accepted by the client or None for identity
+    """
+    accepted = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = item.strip().lower().split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+class StreamCompressor:
+    """
+    Compresses a body sent in parts, every part is flushed so the client can decode it right away
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._compressor = None
+
+    def compress(self, data: bytes):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == 'gzip':
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        if self.encoding == 'gzip':
+            return self._compressor.flush()
+        return b''
+
+
+def encode_body(body: bytes, encoding):
+    """
+    Returns (encoding, body) pair, bodies too small to benefit from compression are left as is
+    """
+    if encoding is None or len(body) < MIN_COMPRESSED_SIZE:
+        return None, body
+    return encoding, compress(body, encoding)
+
+
+def entity_tag(version, encoding=None):
+    """
+    Strong ETag of a representation rendered from data `version`, compressed bodies
+    are different representations, so they get their own tags
+    """
+    return f'"v{version}-{encoding}"' if encoding else f'"v{version}"'
+
+
+def _validators(version, updated_dt, encoding):
+    headers = {
+        'ETag': entity_tag(version, encoding),
+        # clients may keep the body, but have to revalidate it every time
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+    if updated_dt is not None:
+        headers['Last-Modified'] = format_datetime(updated_dt, usegmt=True)
+    return headers
+
+
+def is_not_modified(request, version, updated_dt):
+    """
+    Evaluates If-None-Match and If-Modified-Since against the data version,
+    a tag of any content coding of the current version matches
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        current = {entity_tag(version)} | {entity_tag(version, encoding) for encoding in ENCODINGS}
+        tags = (tag.strip() for tag in if_none_match.split(','))
+        # weak tags match too, str.removeprefix is not available on Python 3.8
+        return any((tag[2:] if tag.startswith('W/') else tag) in current for tag in tags)
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is not None and updated_dt is not None:
+        try:
+            return updated_dt.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified(request, version, updated_dt, encoding):
+    """
+    Returns 304 response if the client already has the representation of `version`, otherwise None.
+    `encoding` is the content coding of the body the full response would have
+    """
+    if version is None or not is_not_modified(request, version, updated_dt):
+        return None
+    return web.Response(status=304, headers=_validators(version, updated_dt, encoding))
+
+
+def versioned_response(body: bytes, content_type, version, updated_dt, encoding=None):
+    """
+    Response with validators of data `version` for a body already compressed with `encoding`
+    """
+    headers = _validators(version, updated_dt, encoding)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=body, headers=headers, content_type=content_type, charset='utf-8')
+
+
+def versioned_stream_response(content_type, version, updated_dt, encoding=None):
+    """
+    Not yet prepared stream response with validators of data `version` for a body to be compressed with `encoding`
+    """
+    headers = _validators(version, updated_dt, encoding)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    response = web.StreamResponse(headers=headers)
+    response.content_type = content_type
+    response.charset = 'utf-8'
+    response.enable_chunked_encoding()
+    return response